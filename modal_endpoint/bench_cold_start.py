@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# modal_endpoint/bench_cold_start.py
+"""
+Start-up benchmark on a tiny FLUX transformer, without the real weights.
+
+A small-config FluxTransformer2DModel is saved with save_pretrained and
+loaded back through startup.load_pretrained, the same from_pretrained call
+(and kwargs) FluxLoraGenerator.load_base_model uses, then moved with
+`.to()` as move_to_gpu does (CUDA when available, otherwise CPU, where the
+move is close to free). A change to the load path, e.g. losing
+local_files_only or low_cpu_mem_usage, shows up in load_cpu.
+
+    python bench_cold_start.py --out bench.json
+    python bench_cold_start.py --baseline bench.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from startup import PhaseTimer, load_pretrained
+
+HEAD_DIM = 64
+
+
+def build_stand_in(path: Path, layers: int, single_layers: int, heads: int) -> int:
+    """save_pretrained a FLUX-shaped transformer; returns the weight bytes"""
+    import torch
+    from diffusers import FluxTransformer2DModel
+
+    torch.manual_seed(0)
+    model = FluxTransformer2DModel(
+        patch_size=1,
+        in_channels=64,
+        num_layers=layers,
+        num_single_layers=single_layers,
+        attention_head_dim=HEAD_DIM,
+        num_attention_heads=heads,
+        joint_attention_dim=heads * HEAD_DIM,
+        pooled_projection_dim=256,
+        guidance_embeds=True,
+        axes_dims_rope=(16, 24, 24),
+    ).to(torch.bfloat16)
+    model.save_pretrained(str(path), safe_serialization=True)
+    return sum(f.stat().st_size for f in path.glob("*.safetensors"))
+
+
+def run_once(path: Path, cache_dir: str, device: str) -> dict:
+    import torch
+    from diffusers import FluxTransformer2DModel
+
+    timer = PhaseTimer("from_pretrained")
+
+    with timer.phase("load_cpu"):
+        model = load_pretrained(FluxTransformer2DModel, str(path), cache_dir, torch.bfloat16)
+
+    with timer.phase("to_device"):
+        model.to(device)
+        if device == "cuda":
+            torch.cuda.synchronize()
+
+    return timer.report()
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for mode, result in report["modes"].items():
+        base = baseline.get("modes", {}).get(mode)
+        if not base:
+            continue
+        for phase, seconds in result["phases"].items():
+            before = base["phases"].get(phase)
+            if before and seconds > before * (1 + tolerance):
+                regressions.append(f"{mode}.{phase}: {before:.3f}s -> {seconds:.3f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--layers", type=int, default=2, help="Double-stream blocks")
+    parser.add_argument("--single-layers", type=int, default=4, help="Single-stream blocks")
+    parser.add_argument("--heads", type=int, default=8, help=f"Attention heads ({HEAD_DIM} dims each)")
+    parser.add_argument("--device", help="Default: cuda when available, else cpu")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Fail if slower than this report")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    import torch
+
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "transformer"
+        size = build_stand_in(path, args.layers, args.single_layers, args.heads)
+
+        runs = [run_once(path, tmp, device) for _ in range(args.repeat)]
+        # Median per phase; the first run also pays page-cache warm-up
+        phases = {
+            phase: sorted(r["phases"][phase] for r in runs)[len(runs) // 2]
+            for phase in runs[0]["phases"]
+        }
+        modes = {"from_pretrained": {"phases": phases, "total": round(sum(phases.values()), 4)}}
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "weights_mb": round(size / 1024**2, 1),
+        "layers": args.layers,
+        "single_layers": args.single_layers,
+        "heads": args.heads,
+        "device": device,
+        "repeat": args.repeat,
+        "modes": modes,
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if regressions:
+            print("Start-up regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,14 @@ import os
 import io
 import base64
 import uuid
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lora_adapters import BESIDE, FUSED, UNFUSED, AdapterRegistry, AdapterSpec, FusePolicy, specs_from_request
+from preview import MODES, REFINED, DraftUnavailable, ModeLatency, PreviewJobs, PreviewRunner
+from result_cache import DictBackend, FileBackend, ResultCache
+from startup import PhaseTimer, load_pretrained
 
 app = modal.App("carmi-flux-lora-inference")
 
@@ -43,6 +51,95 @@ inference_image = (
 model_cache = modal.Volume.from_name("flux-model-cache", create_if_missing=True)
 CACHE_DIR = "/root/.cache/huggingface/hub"
 
+DEFAULT_OUTPUT_FORMAT = os.environ.get("FLUX_OUTPUT_FORMAT", "png")
+PNG_COMPRESS_LEVEL = int(os.environ.get("FLUX_PNG_COMPRESS_LEVEL", "1"))
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+result_index = modal.Dict.from_name("flux-result-cache", create_if_missing=True)
+# Draft → refine job records, shared so a refine can land on any container
+preview_index = modal.Dict.from_name("flux-preview-jobs", create_if_missing=True)
+
+
+def render_params(prompt, specs, seed, width, height, steps, guidance, fmt, quality) -> dict:
+    """Everything that determines the output image, with numbers already normalized by `_render`"""
+    return {
+        "prompt": prompt,
+        "loras": [[s.url, s.scale] for s in specs],
+        "seed": seed,
+        "width": width,
+        "height": height,
+        "num_inference_steps": steps,
+        "guidance_scale": guidance,
+        "output_format": fmt,
+        "output_quality": quality,
+    }
+
+
+class FluxPreviewBackend:
+    """PreviewRunner backend over the loaded FluxPipeline"""
+
+    def __init__(self, pipe, http):
+        self.pipe = pipe
+        self.http = http
+        try:
+            from diffusers import FluxImg2ImgPipeline
+
+            # Shares every module (and the loaded adapters) with `pipe`
+            self.img2img_pipe = FluxImg2ImgPipeline(**pipe.components)
+        except ImportError:
+            self.img2img_pipe = None
+
+    @property
+    def can_img2img(self) -> bool:
+        return self.img2img_pipe is not None
+
+    @staticmethod
+    def _generator(seed: int):
+        import torch
+
+        return torch.Generator("cuda").manual_seed(seed)
+
+    def encode(self, prompt: str):
+        prompt_embeds, pooled_prompt_embeds, _ = self.pipe.encode_prompt(prompt=prompt, prompt_2=None)
+        return prompt_embeds, pooled_prompt_embeds
+
+    def txt2img(self, embeds, width, height, steps, guidance, seed):
+        return self.pipe(
+            prompt_embeds=embeds[0],
+            pooled_prompt_embeds=embeds[1],
+            num_inference_steps=steps,
+            guidance_scale=guidance,
+            width=width,
+            height=height,
+            generator=self._generator(seed),
+        ).images[0]
+
+    def img2img(self, embeds, image, width, height, steps, strength, guidance, seed):
+        from PIL import Image
+
+        return self.img2img_pipe(
+            prompt_embeds=embeds[0],
+            pooled_prompt_embeds=embeds[1],
+            image=image.resize((width, height), Image.Resampling.LANCZOS),
+            strength=strength,
+            num_inference_steps=steps,
+            guidance_scale=guidance,
+            width=width,
+            height=height,
+            generator=self._generator(seed),
+        ).images[0]
+
+    def fetch(self, url: str):
+        from PIL import Image
+
+        try:
+            resp = self.http.get(url, timeout=30)
+            resp.raise_for_status()
+            return Image.open(io.BytesIO(resp.content)).convert("RGB")
+        except Exception as e:
+            print(f"   Draft not available ({e})")
+            return None
+
 
 @app.cls(
     image=inference_image,
@@ -55,34 +152,315 @@ CACHE_DIR = "/root/.cache/huggingface/hub"
     volumes={CACHE_DIR: model_cache},
     container_idle_timeout=300,
     allow_concurrent_inputs=5,
+    enable_memory_snapshot=True,
+    mounts=[modal.Mount.from_local_python_packages("lora_adapters", "preview", "result_cache", "startup")],
 )
 class FluxLoraGenerator:
 
-    @modal.enter()
+    @modal.enter(snap=True)
     def load_base_model(self):
+        """CPU-only start-up; captured by the memory snapshot"""
         import torch
         from diffusers import FluxPipeline
         from huggingface_hub import login
 
-        hf_token = os.environ.get("HF_TOKEN")
-        if hf_token:
-            login(token=hf_token)
+        self._startup = PhaseTimer("startup")
+
+        with self._startup.phase("hf_login"):
+            hf_token = os.environ.get("HF_TOKEN")
+            if hf_token:
+                login(token=hf_token)
 
         print("Loading FLUX.1-dev...")
-        self.pipe = FluxPipeline.from_pretrained(
-            "black-forest-labs/FLUX.1-dev",
-            torch_dtype=torch.bfloat16,
-            cache_dir=CACHE_DIR,
+        with self._startup.phase("load_cpu"):
+            # Same call bench_cold_start.py times
+            self.pipe = load_pretrained(
+                FluxPipeline, "black-forest-labs/FLUX.1-dev", CACHE_DIR, torch.bfloat16,
+            )
+
+        self.adapters = AdapterRegistry(self.pipe)
+        self.fuse_policy = FusePolicy(
+            threshold=float(os.environ.get("FLUX_FUSE_THRESHOLD", "0.6")),
+            window=int(os.environ.get("FLUX_FUSE_WINDOW", "50")),
+            min_requests=int(os.environ.get("FLUX_FUSE_MIN_REQUESTS", "10")),
+            release_threshold=float(os.environ.get("FLUX_UNFUSE_THRESHOLD", "0.4")),
+        )
+        # Host RAM allowed for a pristine copy of the base weights, taken on
+        # the first fuse and kept; above it we fall back to unfuse_lora
+        # (small bf16 drift per cycle)
+        self._fuse_copy_budget = float(os.environ.get("FLUX_FUSE_COPY_BUDGET_GB", "32")) * 1024**3
+        self._fuse_copy = None
+        self._beside = None
+
+        # FLUX_RESULT_CACHE=volume keeps the index next to the model weights
+        if os.environ.get("FLUX_RESULT_CACHE", "dict") == "volume":
+            backend = FileBackend(
+                f"{CACHE_DIR}/result-index",
+                on_write=model_cache.commit,
+                on_miss=model_cache.reload,
+            )
+        else:
+            backend = DictBackend(result_index)
+        ttl = float(os.environ.get("FLUX_RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+        self.results = ResultCache(backend, ttl=ttl) if ttl > 0 else None
+
+    @modal.enter(snap=False)
+    def move_to_gpu(self):
+        """Runs on every start, after the snapshot is restored"""
+        import torch
+        import requests
+
+        with self._startup.phase("to_cuda"):
+            self.pipe.to("cuda")
+            torch.cuda.synchronize()
+        print(f"FLUX.1-dev loaded! {self._startup.report()}")
+
+        # Concurrent inputs share one pipeline; adapter state and the
+        # denoising loop must not interleave between requests
+        self._gpu_lock = threading.Lock()
+
+        self._post_pool = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("FLUX_POST_WORKERS", "4")),
+            thread_name_prefix="flux-post",
+        )
+        self._http = requests.Session()
+        self._bucket_checked = False
+
+        self.previews = PreviewRunner(
+            FluxPreviewBackend(self.pipe, self._http),
+            PreviewJobs(
+                DictBackend(preview_index),
+                ttl=float(os.environ.get("FLUX_PREVIEW_TTL", "3600")),
+            ),
+        )
+        self.mode_latency = ModeLatency()
+
+    @modal.exit()
+    def drain_uploads(self):
+        # Don't lose uploads whose URL was already handed out
+        self._post_pool.shutdown(wait=True)
+
+    def _public_url(self, file_name: str) -> str:
+        return f"{os.environ['SUPABASE_URL']}/storage/v1/object/public/generations/{file_name}"
+
+    def _encode(self, image, fmt: str, quality: int) -> bytes:
+        buffer = io.BytesIO()
+        if fmt == "png":
+            # Level 1 is several times faster than PIL's default 6 for ~10% more bytes
+            image.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        elif fmt == "webp":
+            image.save(buffer, format="WEBP", quality=quality, method=4)
+        else:
+            image.save(buffer, format="JPEG", quality=quality, optimize=False)
+        return buffer.getvalue()
+
+    def _encode_and_upload(self, image, fmt: str, quality: int, file_name: str, cache_params) -> tuple:
+        """Runs on the post-processing pool; returns (public_url or None, bytes)"""
+        started = time.perf_counter()
+        img_bytes = self._encode(image, fmt, quality)
+        encode_seconds = time.perf_counter() - started
+        return self._upload(img_bytes, fmt, file_name, cache_params, encode_seconds)
+
+    def _upload(
+        self, img_bytes: bytes, fmt: str, file_name: str, cache_params, encode_seconds: float = 0.0,
+    ) -> tuple:
+        """Upload already-encoded bytes; returns (public_url or None, bytes)"""
+        encoded = time.perf_counter()
+
+        supabase_url = os.environ["SUPABASE_URL"]
+        supabase_key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+        upload_url = f"{supabase_url}/storage/v1/object/generations/{file_name}"
+        headers = {
+            "Authorization": f"Bearer {supabase_key}",
+            "Content-Type": CONTENT_TYPES[fmt],
+            "x-upsert": "true",
+        }
+
+        try:
+            upload_resp = self._http.post(upload_url, headers=headers, data=img_bytes, timeout=120)
+
+            if upload_resp.status_code not in (200, 201) and not self._bucket_checked:
+                # Try creating bucket (once per container)
+                self._bucket_checked = True
+                self._http.post(
+                    f"{supabase_url}/storage/v1/bucket",
+                    headers={
+                        "Authorization": f"Bearer {supabase_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json={"id": "generations", "name": "generations", "public": True},
+                    timeout=30,
+                )
+                upload_resp = self._http.post(upload_url, headers=headers, data=img_bytes, timeout=120)
+        except Exception as e:
+            print(f"❌ Upload error for {file_name}: {e}")
+            return None, img_bytes
+
+        if upload_resp.status_code not in (200, 201):
+            print(f"❌ Upload failed for {file_name}: {upload_resp.status_code}")
+            return None, img_bytes
+
+        public_url = self._public_url(file_name)
+        print(
+            f"✅ Uploaded: {public_url} ({len(img_bytes) / 1024:.0f} KB {fmt}, "
+            f"encode {encode_seconds:.2f}s, upload {time.perf_counter() - encoded:.2f}s)"
+        )
+        if cache_params:
+            self.results.put(cache_params, public_url)
+        return public_url, img_bytes
+
+    @staticmethod
+    def _log_background_upload(done, file_name: str) -> None:
+        error = done.exception()
+        if error is not None:
+            print(f"❌ Background upload of {file_name} failed: {error!r}")
+        elif done.result()[0] is None:
+            print(f"❌ Background upload of {file_name} failed; its URL will not resolve")
+
+    def _lora_layers(self):
+        """PEFT-wrapped transformer layers (the ones fuse_lora writes into)"""
+        return [
+            (name, module)
+            for name, module in self.pipe.transformer.named_modules()
+            if hasattr(module, "base_layer") and hasattr(module, "merged_adapters")
+        ]
+
+    def _fuse(self, key: tuple):
+        layers = self._lora_layers()
+        if self._fuse_copy is None:
+            # The base weights never change, so one copy serves every fuse cycle
+            copy_bytes = sum(
+                m.base_layer.weight.numel() * m.base_layer.weight.element_size()
+                for _, m in layers
+            )
+            if copy_bytes <= self._fuse_copy_budget:
+                self._fuse_copy = {
+                    name: m.base_layer.weight.detach().to("cpu", copy=True)
+                    for name, m in layers
+                }
+                print(f"   Kept pristine base copy ({copy_bytes / 1024**3:.1f} GB)")
+
+        # Transformer only: that is all _lora_layers() and the pristine copy cover
+        self.pipe.fuse_lora(
+            components=["transformer"], adapter_names=[name for name, _ in key], lora_scale=1.0,
+        )
+        self.fuse_policy.fused_key = key
+        kept = "kept copy" if self._fuse_copy is not None else "no copy"
+        print(f"   Fused adapters {list(key)} ({kept})")
+
+    def _unfuse(self):
+        if self._fuse_copy is None:
+            self.pipe.unfuse_lora(components=["transformer"])
+        else:
+            import torch
+
+            with torch.no_grad():
+                for name, module in self._lora_layers():
+                    saved = self._fuse_copy.get(name)
+                    if saved is not None:
+                        module.base_layer.weight.copy_(saved, non_blocking=True)
+                        # Tell PEFT the adapters are no longer merged
+                        module.merged_adapters = []
+            torch.cuda.synchronize()
+
+            # ...and the pipeline, which tracks fused adapters on its own
+            if hasattr(self.pipe, "_merged_adapters"):
+                self.pipe._merged_adapters = set()
+            else:
+                self.pipe.num_fused_loras = 0
+
+        print(f"   Unfused adapters {list(self.fuse_policy.fused_key)}")
+        self.fuse_policy.fused_key = None
+
+    def _start_beside(self, specs: list) -> bool:
+        """
+        Serve `specs` while another set stays fused: PEFT is told nothing is
+        merged and the fused adapters run at negated scales next to the
+        requested ones, cancelling their merged deltas. No weights move;
+        the request pays the unfused LoRA overhead for both sets.
+        """
+        weights = {}
+        for name, scale in self.fuse_policy.fused_key:
+            weights[name] = weights.get(name, 0.0) - scale
+        for spec in specs:
+            weights[spec.name] = weights.get(spec.name, 0.0) + spec.scale
+        weights = {name: w for name, w in weights.items() if abs(w) > 1e-6}
+        if not weights:
+            return False
+
+        self._beside = [(m, m.merged_adapters) for _, m in self._lora_layers()]
+        for module, _ in self._beside:
+            module.merged_adapters = []
+        self.pipe.set_adapters(list(weights), adapter_weights=list(weights.values()))
+        # The registry's view of the active weights no longer holds
+        self.adapters.active = None
+        return True
+
+    def _end_beside(self):
+        for module, merged in self._beside:
+            module.merged_adapters = merged
+        self._beside = None
+
+    def _deliver(
+        self,
+        image,
+        fmt: str,
+        quality: int,
+        seed: int,
+        cache_params=None,
+        wait_for_upload: bool = True,
+        on_uploaded=None,
+    ) -> dict:
+        """
+        Encode + upload run on the post-processing pool; the GPU lock is
+        already released, so the next queued request can start denoising
+        """
+        file_name = f"{uuid.uuid4().hex}.{fmt}"
+        upload = self._post_pool.submit(
+            self._encode_and_upload, image, fmt, quality, file_name, cache_params
         )
-        self.pipe.to("cuda")
-        print("FLUX.1-dev loaded!")
 
-        self._current_lora_url = None
+        if not wait_for_upload:
+            public_url = self._public_url(file_name)
+            # Nobody waits on this future, so failures must at least be logged
+            upload.add_done_callback(lambda done: self._log_background_upload(done, file_name))
+            if on_uploaded:
+                on_uploaded(public_url)
+            return {"success": True, "image_url": public_url, "seed": seed, "upload_pending": True}
+
+        public_url, img_bytes = upload.result()
+        if public_url:
+            if on_uploaded:
+                on_uploaded(public_url)
+            return {"success": True, "image_url": public_url, "seed": seed}
+        print(f"Upload failed, returning base64")
+        img_b64 = base64.b64encode(img_bytes).decode()
+        return {"success": True, "image_base64": img_b64, "seed": seed}
+
+    def _apply_adapters(self, specs: list) -> tuple:
+        """Call with the GPU lock held; returns (key, path) with path FUSED, UNFUSED or BESIDE"""
+        key = tuple((s.name, s.scale) for s in specs)
+        fusion = self.fuse_policy.decide(key)
+        if self._beside is not None:
+            self._end_beside()
+        if fusion["unfuse"]:
+            self._unfuse()
+
+        # Weight-only changes never reload; new URLs are downloaded once.
+        # The fused set's adapters must stay loaded to run beside it
+        fused_names = [name for name, _ in self.fuse_policy.fused_key or ()]
+        self.adapters.apply(specs, pinned=fused_names)
+
+        if fusion["fuse"]:
+            self._fuse(key)
+        elif fusion["beside"] and self._start_beside(specs):
+            return key, BESIDE
+        return key, FUSED if self.fuse_policy.fused_key is not None else UNFUSED
 
     def _generate_image(
         self,
-        prompt: str,
-        model_url: str,
+        prompt: str = "",
+        model_url: str = "",
         trigger_word: str = "ohwx",
         num_inference_steps: int = 28,
         guidance_scale: float = 3.5,
@@ -90,52 +468,110 @@ class FluxLoraGenerator:
         height: int = 1024,
         seed: int = -1,
         lora_scale: float = 1.0,
+        extra_loras: list | None = None,
+        output_format: str = DEFAULT_OUTPUT_FORMAT,
+        output_quality: int = 90,
+        wait_for_upload: bool = True,
+        mode: str = "full",
+        job_id: str | None = None,
     ) -> dict:
-        import torch
-        import requests
-        from pathlib import Path
+        """
+        mode "full" renders the request as is; "draft" renders a fast
+        low-res preview and returns a job_id; "refine" with that job_id
+        renders the full image starting from the draft
+        """
+        started = time.perf_counter()
+        if mode not in MODES:
+            return {"success": False, "error": f"Unsupported mode: {mode}"}
 
         try:
-            # Load LoRA if different from current
-            if model_url != self._current_lora_url:
-                print(f"Loading LoRA from: {model_url}")
-
-                # Unload previous LoRA
-                if self._current_lora_url:
-                    try:
-                        self.pipe.unload_lora_weights()
-                        print("   Previous LoRA unloaded")
-                    except Exception as e:
-                        print(f"   Could not unload: {e}")
-
-                # Download LoRA
-                lora_path = Path("/tmp/current_lora.safetensors")
-                resp = requests.get(model_url, timeout=120)
-                resp.raise_for_status()
-                lora_path.write_bytes(resp.content)
-                size_mb = lora_path.stat().st_size / (1024 * 1024)
-                print(f"   Downloaded: {size_mb:.1f} MB")
-
-                # Load LoRA - FAL produces standard diffusers format
-                self.pipe.load_lora_weights(
-                    str(lora_path),
-                    adapter_name="character"
+            if mode == "refine":
+                response = self._refine(job_id, wait_for_upload)
+            else:
+                response = self._render(
+                    prompt, model_url, trigger_word, num_inference_steps, guidance_scale,
+                    width, height, seed, lora_scale, extra_loras, output_format,
+                    output_quality, wait_for_upload, mode,
                 )
-                self.pipe.set_adapters(["character"], adapter_weights=[lora_scale])
-                
-                self._current_lora_url = model_url
-                print("   LoRA loaded successfully!")
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            import traceback
+            traceback.print_exc()
+            return {"success": False, "error": str(e)}
 
-            # Add trigger word to prompt
-            if trigger_word and trigger_word.lower() not in prompt.lower():
-                prompt = f"{trigger_word} {prompt}"
+        if response.get("success"):
+            seconds = time.perf_counter() - started
+            if not response.get("cached"):
+                self.mode_latency.record(mode, seconds)
+            response["mode"] = mode
+            response["latency_seconds"] = round(seconds, 3)
+        return response
 
-            print(f"Generating: {prompt[:80]}...")
+    def _render(
+        self,
+        prompt, model_url, trigger_word, num_inference_steps, guidance_scale,
+        width, height, seed, lora_scale, extra_loras, output_format,
+        output_quality, wait_for_upload, mode,
+    ) -> dict:
+        import torch
+
+        specs = specs_from_request(model_url, lora_scale, extra_loras)
+
+        fmt = output_format.lower().replace("jpg", "jpeg")
+        if fmt not in CONTENT_TYPES:
+            return {"success": False, "error": f"Unsupported output_format: {output_format}"}
+        # Checked before any GPU work: a bad value would only fail in the encoder
+        try:
+            output_quality = int(output_quality)
+        except (TypeError, ValueError):
+            output_quality = 0
+        if not 1 <= output_quality <= 100:
+            return {"success": False, "error": "output_quality must be an integer from 1 to 100"}
+        # Ints here so 1024 and 1024.0 give the same cache key
+        try:
+            seed, width, height, num_inference_steps = (
+                int(seed), int(width), int(height), int(num_inference_steps)
+            )
+            guidance_scale = float(guidance_scale)
+        except (TypeError, ValueError):
+            return {"success": False, "error": "seed, width, height and num_inference_steps must be integers"}
+
+        # Add trigger word to prompt
+        if trigger_word and trigger_word.lower() not in prompt.lower():
+            prompt = f"{trigger_word} {prompt}"
+
+        # Same seeded parameters always give the same image
+        cache_params = None
+        if mode == "full" and seed >= 0 and self.results:
+            cache_params = render_params(prompt, specs, seed, width, height, num_inference_steps,
+                                         guidance_scale, fmt, output_quality)
+            if fmt == "png":
+                # Lossless: quality doesn't change the bytes
+                del cache_params["output_quality"]
+            cached_url = self.results.get(cache_params)
+            if cached_url:
+                print(f"♻️ Cache hit: {cached_url}")
+                return {"success": True, "image_url": cached_url, "seed": seed, "cached": True}
+
+        # Handle seed
+        if seed < 0:
+            seed = torch.randint(0, 2**32, (1,)).item()
+
+        if mode == "draft":
+            # Job ids are always minted here, so a client can't pick (or reuse) one
+            return self._draft(
+                uuid.uuid4().hex, specs,
+                render_params(prompt, specs, seed, width, height, num_inference_steps,
+                              guidance_scale, fmt, output_quality),
+            )
+
+        generator = torch.Generator("cuda").manual_seed(seed)
+
+        with self._gpu_lock:
+            _, path = self._apply_adapters(specs)
 
-            # Handle seed
-            if seed < 0:
-                seed = torch.randint(0, 2**32, (1,)).item()
-            generator = torch.Generator("cuda").manual_seed(seed)
+            print(f"Generating: {prompt[:80]}...")
+            started = time.perf_counter()
 
             # Generate image
             result = self.pipe(
@@ -147,74 +583,113 @@ class FluxLoraGenerator:
                 generator=generator,
             )
 
-            image = result.images[0]
-            print("   Image generated!")
-
-            # Upload to Supabase
-            supabase_url = os.environ["SUPABASE_URL"]
-            supabase_key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
-
-            img_buffer = io.BytesIO()
-            image.save(img_buffer, format="PNG")
-            img_bytes = img_buffer.getvalue()
-
-            file_name = f"{uuid.uuid4().hex}.png"
-            upload_url = f"{supabase_url}/storage/v1/object/generations/{file_name}"
-
-            upload_resp = requests.post(
-                upload_url,
-                headers={
-                    "Authorization": f"Bearer {supabase_key}",
-                    "Content-Type": "image/png",
-                    "x-upsert": "true",
-                },
-                data=img_bytes,
-                timeout=120,
-            )
+            elapsed = time.perf_counter() - started
+            self.fuse_policy.record(path, num_inference_steps, elapsed)
 
-            if upload_resp.status_code not in (200, 201):
-                # Try creating bucket
-                requests.post(
-                    f"{supabase_url}/storage/v1/bucket",
-                    headers={
-                        "Authorization": f"Bearer {supabase_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={"id": "generations", "name": "generations", "public": True},
-                )
-                upload_resp = requests.post(upload_url, headers={
-                    "Authorization": f"Bearer {supabase_key}",
-                    "Content-Type": "image/png",
-                    "x-upsert": "true",
-                }, data=img_bytes)
-
-            if upload_resp.status_code in (200, 201):
-                public_url = f"{supabase_url}/storage/v1/object/public/generations/{file_name}"
-                print(f"✅ Uploaded: {public_url}")
-                return {"success": True, "image_url": public_url, "seed": seed}
-            else:
-                print(f"Upload failed, returning base64")
-                img_b64 = base64.b64encode(img_bytes).decode()
-                return {"success": True, "image_base64": img_b64, "seed": seed}
+        image = result.images[0]
+        print(f"   Image generated! ({num_inference_steps / elapsed:.2f} steps/s, {path})")
 
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            import traceback
-            traceback.print_exc()
-            return {"success": False, "error": str(e)}
+        return self._deliver(image, fmt, output_quality, seed, cache_params, wait_for_upload)
+
+    def _draft(self, job_id: str, specs: list, params: dict) -> dict:
+        """Low-res, low-step preview; returned inline, uploaded in the background"""
+        draft_name = f"draft-{job_id}.jpeg"
+
+        with self._gpu_lock:
+            self._apply_adapters(specs)
+            print(f"Drafting: {params['prompt'][:80]}...")
+            image, _ = self.previews.draft(job_id, params, draft_url=self._public_url(draft_name))
+
+        # Encoded once: returned inline and uploaded for refines on other containers
+        draft_bytes = self._encode(image, "jpeg", 85)
+        upload = self._post_pool.submit(self._upload, draft_bytes, "jpeg", draft_name, None)
+        upload.add_done_callback(lambda done: self._log_background_upload(done, draft_name))
+
+        return {
+            "success": True,
+            "job_id": job_id,
+            "seed": params["seed"],
+            "image_base64": base64.b64encode(draft_bytes).decode(),
+            "image_url": self._public_url(draft_name),
+            "upload_pending": True,
+            "width": image.width,
+            "height": image.height,
+        }
+
+    def _refine(self, job_id: str | None, wait_for_upload: bool) -> dict:
+        """Full-quality render of a drafted job, from its cached state"""
+        entry = self.previews.jobs.get(job_id) if job_id else None
+        if entry is None:
+            return {"success": False, "error": "Unknown or expired job_id; request a new draft"}
+
+        params = entry.params
+        if entry.status == REFINED and entry.image_url:
+            return {
+                "success": True,
+                "job_id": job_id,
+                "image_url": entry.image_url,
+                "seed": params["seed"],
+                "cached": True,
+            }
+
+        specs = [AdapterSpec(url, scale) for url, scale in params["loras"]]
+
+        # Network fetch of the uploaded draft happens before taking the GPU
+        try:
+            prepared = self.previews.prepare_refine(entry)
+        except DraftUnavailable as e:
+            # Rendering without the draft would not be the image the user approved
+            return {"success": False, "error": str(e), "job_id": job_id, "retryable": True}
+
+        with self._gpu_lock:
+            _, path = self._apply_adapters(specs)
+
+            print(f"Refining {job_id}: {params['prompt'][:80]}...")
+            started = time.perf_counter()
+            image, from_draft = self.previews.refine(entry, prepared)
+            elapsed = time.perf_counter() - started
+
+            steps = self.previews.refine_steps(params, from_draft)
+            self.fuse_policy.record(path, steps, elapsed)
+
+        print(f"   Refined in {elapsed:.2f}s ({steps} steps, from_draft={from_draft})")
+
+        response = self._deliver(
+            image, params["output_format"], params["output_quality"], params["seed"],
+            wait_for_upload=wait_for_upload,
+            on_uploaded=lambda url: self.previews.complete(entry, url),
+        )
+        response["job_id"] = job_id
+        response["refined_from_draft"] = from_draft
+        return response
 
     @modal.method()
     def generate(self, **kwargs) -> dict:
         return self._generate_image(**kwargs)
 
+    @modal.method()
+    def lora_stats(self) -> dict:
+        """Fused / unfused / beside steps/sec and the currently fused adapter set"""
+        return self.fuse_policy.summary()
+
+    @modal.method()
+    def latency_stats(self) -> dict:
+        """Request latency per mode (full / draft / refine)"""
+        return self.mode_latency.summary()
+
     @modal.fastapi_endpoint(method="POST", label="carmi-generate-lora")
     def generate_endpoint(self, request: dict) -> dict:
-        if "prompt" not in request or "model_url" not in request:
+        mode = request.get("mode", "full")
+        if mode == "refine":
+            # Everything else comes from the draft
+            if not request.get("job_id"):
+                return {"success": False, "error": "Missing job_id"}
+        elif "prompt" not in request or "model_url" not in request:
             return {"success": False, "error": "Missing prompt or model_url"}
 
         return self._generate_image(
-            prompt=request["prompt"],
-            model_url=request["model_url"],
+            prompt=request.get("prompt", ""),
+            model_url=request.get("model_url", ""),
             trigger_word=request.get("trigger_word", "ohwx"),
             num_inference_steps=request.get("num_inference_steps", 28),
             guidance_scale=request.get("guidance_scale", 3.5),
@@ -222,4 +697,10 @@ class FluxLoraGenerator:
             height=request.get("height", 1024),
             seed=request.get("seed", -1),
             lora_scale=request.get("lora_scale", 1.0),
+            extra_loras=request.get("extra_loras"),
+            output_format=request.get("output_format", DEFAULT_OUTPUT_FORMAT),
+            output_quality=request.get("output_quality", 90),
+            wait_for_upload=request.get("wait_for_upload", True),
+            mode=mode,
+            job_id=request.get("job_id"),
         )
\ No newline at end of file
@@ -0,0 +1,207 @@
+# modal_endpoint/lora_adapters.py
+"""
+LoRA adapter state for the FLUX inference container.
+
+Tracks which adapters are loaded into the pipeline and which are active at
+what weight, so every request pays only for the transition it needs:
+nothing, a weight update, or a download + load.
+"""
+
+import hashlib
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+LORA_DIR = Path("/tmp/loras")
+
+# How a request ran, for FusePolicy's throughput buckets
+FUSED = "fused"
+UNFUSED = "unfused"
+BESIDE = "beside"
+
+
+@dataclass(frozen=True)
+class AdapterSpec:
+    """One LoRA requested for a generation: where it lives and how strong."""
+
+    url: str
+    scale: float = 1.0
+
+    @property
+    def name(self) -> str:
+        # Stable per URL, so the same LoRA keeps its adapter slot across requests
+        return "lora_" + hashlib.sha1(self.url.encode()).hexdigest()[:12]
+
+
+def specs_from_request(
+    model_url: str,
+    lora_scale: float = 1.0,
+    extra_loras: Optional[list] = None,
+) -> list:
+    """Character LoRA first, then any extra (style) LoRAs from the request"""
+    specs = [AdapterSpec(model_url, float(lora_scale))]
+    seen = {model_url}
+
+    for entry in extra_loras or []:
+        url = entry.get("model_url") if isinstance(entry, dict) else entry
+        if not url or url in seen:
+            continue
+        scale = entry.get("scale", 1.0) if isinstance(entry, dict) else 1.0
+        specs.append(AdapterSpec(url, float(scale)))
+        seen.add(url)
+
+    return specs
+
+
+def download_lora(url: str, path: Path) -> None:
+    import requests
+
+    resp = requests.get(url, timeout=120)
+    resp.raise_for_status()
+    path.write_bytes(resp.content)
+
+
+class AdapterRegistry:
+    """
+    Owns the adapter state of one pipeline.
+
+    `pipe` only needs the diffusers LoRA methods (`load_lora_weights`,
+    `set_adapters`, `delete_adapters`), so a stub works in tests.
+    Loaded adapters are kept in LRU order up to `max_loaded`.
+    """
+
+    def __init__(
+        self,
+        pipe,
+        download: Callable[[str, Path], None] = download_lora,
+        max_loaded: int = 4,
+    ):
+        self.pipe = pipe
+        self.download = download
+        self.max_loaded = max(1, max_loaded)
+        self.loaded: "OrderedDict[str, str]" = OrderedDict()
+        self.active: tuple = ()
+
+    def plan(self, specs: list, pinned=()) -> dict:
+        """Cheapest transition from the current state to `specs`; `pinned` names are never evicted"""
+        wanted = tuple((s.name, s.scale) for s in specs)
+        to_load = [s for s in specs if s.name not in self.loaded]
+
+        keep = {s.name for s in specs} | set(pinned)
+        overflow = len(self.loaded) + len(to_load) - self.max_loaded
+        evict = [n for n in self.loaded if n not in keep][:max(0, overflow)]
+
+        return {
+            "load": to_load,
+            "evict": evict,
+            "set_weights": wanted != self.active,
+        }
+
+    def apply(self, specs: list, pinned=()) -> dict:
+        """Bring the pipeline to `specs` and return the plan that was executed"""
+        if not specs:
+            raise ValueError("At least one LoRA is required")
+
+        plan = self.plan(specs, pinned)
+
+        if plan["evict"]:
+            self.pipe.delete_adapters(plan["evict"])
+            for name in plan["evict"]:
+                self.loaded.pop(name, None)
+            print(f"   Evicted adapters: {plan['evict']}")
+
+        for spec in plan["load"]:
+            print(f"Loading LoRA from: {spec.url}")
+            LORA_DIR.mkdir(parents=True, exist_ok=True)
+            lora_path = LORA_DIR / f"{spec.name}.safetensors"
+            self.download(spec.url, lora_path)
+            size_mb = lora_path.stat().st_size / (1024 * 1024)
+            print(f"   Downloaded: {size_mb:.1f} MB")
+
+            # FAL produces standard diffusers format
+            self.pipe.load_lora_weights(str(lora_path), adapter_name=spec.name)
+            lora_path.unlink(missing_ok=True)
+            self.loaded[spec.name] = spec.url
+            # Loading a new adapter activates it, so weights must be re-applied
+            plan["set_weights"] = True
+
+        for spec in specs:
+            self.loaded.move_to_end(spec.name)
+
+        if plan["set_weights"]:
+            self.pipe.set_adapters(
+                [s.name for s in specs],
+                adapter_weights=[s.scale for s in specs],
+            )
+            self.active = tuple((s.name, s.scale) for s in specs)
+            print(f"   Active adapters: {list(self.active)}")
+
+        return plan
+
+
+class FusePolicy:
+    """
+    Decides when the active adapter set is hot enough to fuse into the base
+    weights, and keeps fused / unfused / beside throughput for comparison
+    (beside requests also run the fused set's cancelling adapters, so they
+    are slower than plain unfused ones and are booked separately).
+
+    A set is identified by its `AdapterRegistry.active` key. It is fused once
+    it has at least `threshold` share of the last `window` requests (and the
+    window holds `min_requests`). It stays fused until its share drops below
+    `release_threshold` or another set becomes hot; requests for other sets
+    in between run beside it (`beside`) without touching the fused weights.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.6,
+        window: int = 50,
+        min_requests: int = 10,
+        release_threshold: float = 0.4,
+    ):
+        self.threshold = threshold
+        self.release_threshold = min(release_threshold, threshold)
+        self.min_requests = min_requests
+        self.history: deque = deque(maxlen=window)
+        self.fused_key: Optional[tuple] = None
+        self.speed = {path: [0, 0.0] for path in (FUSED, UNFUSED, BESIDE)}
+
+    def share(self, key: tuple) -> float:
+        if not self.history:
+            return 0.0
+        return sum(1 for k in self.history if k == key) / len(self.history)
+
+    def decide(self, key: tuple) -> dict:
+        """Record a request for `key` and return the transitions to run first"""
+        self.history.append(key)
+        hot = len(self.history) >= self.min_requests and self.share(key) >= self.threshold
+
+        if self.fused_key is None:
+            return {"unfuse": False, "fuse": hot, "beside": False}
+        if self.fused_key == key:
+            return {"unfuse": False, "fuse": False, "beside": False}
+
+        # Hysteresis: a cooling set stays fused down to release_threshold
+        unfuse = hot or self.share(self.fused_key) < self.release_threshold
+        return {"unfuse": unfuse, "fuse": hot, "beside": not unfuse}
+
+    def record(self, path: str, steps: int, seconds: float) -> None:
+        """`path` is FUSED, UNFUSED or BESIDE"""
+        total = self.speed[path]
+        total[0] += steps
+        total[1] += seconds
+
+    def summary(self) -> dict:
+        def rate(path: str) -> Optional[float]:
+            steps, seconds = self.speed[path]
+            return round(steps / seconds, 3) if seconds else None
+
+        return {
+            "fused_key": [list(k) for k in self.fused_key] if self.fused_key else None,
+            "fused_steps_per_sec": rate(FUSED),
+            "unfused_steps_per_sec": rate(UNFUSED),
+            "beside_steps_per_sec": rate(BESIDE),
+            "window_requests": len(self.history),
+        }
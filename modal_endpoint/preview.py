@@ -0,0 +1,262 @@
+# modal_endpoint/preview.py
+"""
+Draft → refine previews for FLUX generation.
+
+A draft renders the request at low resolution with few steps (same seed,
+same adapters) so a composition can be rejected quickly. Its state (the
+prompt embeddings and the draft image) is kept per job id; a refine on the
+same job renders the full-size image as img2img from the upscaled draft,
+so only the last `strength` fraction of the schedule runs and the text
+encoders are skipped.
+
+The runner talks to a small backend (encode / txt2img / img2img / fetch),
+so the state machine runs against a mock pipeline. Job records are kept
+in memory for the local fast path and in a shared KV backend (see
+result_cache.DictBackend) so a refine routed to another container can
+still start from the uploaded draft.
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Optional
+
+DRAFT_STEPS = int(os.environ.get("FLUX_DRAFT_STEPS", "8"))
+DRAFT_LONG_SIDE = int(os.environ.get("FLUX_DRAFT_LONG_SIDE", "512"))
+REFINE_STRENGTH = float(os.environ.get("FLUX_REFINE_STRENGTH", "0.6"))
+# A refine on another container may race the draft upload
+DRAFT_FETCH_ATTEMPTS = int(os.environ.get("FLUX_DRAFT_FETCH_ATTEMPTS", "3"))
+DRAFT_FETCH_DELAY = float(os.environ.get("FLUX_DRAFT_FETCH_DELAY", "1.0"))
+
+MODES = ("full", "draft", "refine")
+DRAFTED = "drafted"
+REFINED = "refined"
+
+
+def draft_size(width: int, height: int, long_side: int = DRAFT_LONG_SIDE) -> tuple:
+    """Scale down to `long_side`, keeping FLUX's multiple-of-16 sizes"""
+    scale = min(1.0, long_side / max(width, height))
+    return (
+        max(16, int(width * scale) // 16 * 16),
+        max(16, int(height * scale) // 16 * 16),
+    )
+
+
+@dataclass
+class PreviewEntry:
+    """
+    One preview job. `params` is everything the full render needs (prompt,
+    loras, seed, size, steps, guidance, output) and is JSON-serializable;
+    `state` holds the local-only (embeddings, draft image) pair.
+    """
+
+    job_id: str
+    params: dict
+    status: str = DRAFTED
+    draft_url: Optional[str] = None
+    image_url: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    state: Any = None
+
+    def record(self) -> dict:
+        data = asdict(self)
+        data.pop("state")
+        return data
+
+
+class DraftUnavailable(Exception):
+    """The draft a refine must start from can't be loaded (yet); retry later"""
+
+
+class PreviewJobs:
+    """
+    Job id → PreviewEntry. The last `max_local` entries stay in memory
+    with their state (LRU); every entry is also written to `backend`
+    without it.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        max_local: int = 16,
+        ttl: float = 3600.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.backend = backend
+        self.max_local = max(1, max_local)
+        self.ttl = ttl
+        self.clock = clock
+        self.local: "OrderedDict[str, PreviewEntry]" = OrderedDict()
+
+    def get(self, job_id: str) -> Optional[PreviewEntry]:
+        entry = self.local.get(job_id)
+        if entry is None and self.backend is not None:
+            try:
+                data = self.backend.get(job_id)
+            except Exception as e:
+                print(f"⚠️ Preview lookup failed: {e}")
+                data = None
+            if data:
+                entry = PreviewEntry(**data)
+
+        if entry is None:
+            return None
+        if self.clock() - entry.created > self.ttl:
+            self.drop(job_id)
+            return None
+        if job_id in self.local:
+            self.local.move_to_end(job_id)
+        return entry
+
+    def put(self, entry: PreviewEntry) -> None:
+        self.local[entry.job_id] = entry
+        self.local.move_to_end(entry.job_id)
+        while len(self.local) > self.max_local:
+            self.local.popitem(last=False)
+
+        if self.backend is not None:
+            try:
+                self.backend.put(entry.job_id, entry.record())
+            except Exception as e:
+                print(f"⚠️ Preview record not shared: {e}")
+
+    def drop(self, job_id: str) -> None:
+        self.local.pop(job_id, None)
+        if self.backend is not None:
+            self.backend.delete(job_id)
+
+
+class ModeLatency:
+    """Wall time per mode over the last `window` requests"""
+
+    def __init__(self, window: int = 200):
+        self.samples = {mode: deque(maxlen=window) for mode in MODES}
+
+    def record(self, mode: str, seconds: float) -> None:
+        self.samples[mode].append(seconds)
+
+    def summary(self) -> dict:
+        out = {}
+        for mode, values in self.samples.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            out[mode] = {
+                "count": len(ordered),
+                "mean": round(sum(ordered) / len(ordered), 3),
+                "p50": round(ordered[len(ordered) // 2], 3),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            }
+        return out
+
+
+class PreviewRunner:
+    """
+    Draft and refine on top of `backend`, which provides:
+        encode(prompt) -> embeddings
+        txt2img(embeds, width, height, steps, guidance, seed) -> image
+        img2img(embeds, image, width, height, steps, strength, guidance, seed) -> image
+        fetch(url) -> image or None
+        can_img2img: bool
+    Adapters, locking and uploads stay with the caller.
+    """
+
+    def __init__(
+        self,
+        backend,
+        jobs: PreviewJobs,
+        draft_steps: int = DRAFT_STEPS,
+        draft_long_side: int = DRAFT_LONG_SIDE,
+        strength: float = REFINE_STRENGTH,
+        fetch_attempts: int = DRAFT_FETCH_ATTEMPTS,
+        fetch_delay: float = DRAFT_FETCH_DELAY,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.backend = backend
+        self.jobs = jobs
+        self.draft_steps = draft_steps
+        self.draft_long_side = draft_long_side
+        self.strength = strength
+        self.fetch_attempts = max(1, fetch_attempts)
+        self.fetch_delay = fetch_delay
+        self.sleep = sleep
+
+    def draft(self, job_id: str, params: dict, draft_url: Optional[str] = None) -> tuple:
+        """Render the preview; returns (image, entry)"""
+        embeds = self.backend.encode(params["prompt"])
+        width, height = draft_size(params["width"], params["height"], self.draft_long_side)
+        steps = min(self.draft_steps, params["num_inference_steps"])
+
+        image = self.backend.txt2img(
+            embeds, width, height, steps, params["guidance_scale"], params["seed"],
+        )
+        entry = PreviewEntry(
+            job_id, params, draft_url=draft_url, created=self.jobs.clock(), state=(embeds, image),
+        )
+        self.jobs.put(entry)
+        return image, entry
+
+    def prepare_refine(self, entry: PreviewEntry) -> tuple:
+        """
+        (embeds, draft) to refine from: the local state, or the uploaded
+        draft when this container never saw the job. Only touches the
+        network, so callers run it before taking the GPU lock.
+
+        When img2img is available the draft is required: the upload is
+        retried `fetch_attempts` times (it may still be in flight), then
+        DraftUnavailable is raised rather than rendering a composition the
+        user never saw.
+        """
+        embeds, draft = entry.state if entry.state is not None else (None, None)
+        if draft is not None or not self.backend.can_img2img:
+            return embeds, draft
+
+        for attempt in range(self.fetch_attempts if entry.draft_url else 0):
+            if attempt:
+                self.sleep(self.fetch_delay * attempt)
+            draft = self.backend.fetch(entry.draft_url)
+            if draft is not None:
+                return embeds, draft
+        raise DraftUnavailable(
+            f"Draft for job {entry.job_id} is not available; retry the refine shortly, "
+            "or request a new draft if it keeps failing"
+        )
+
+    def refine(self, entry: PreviewEntry, prepared: Optional[tuple] = None) -> tuple:
+        """
+        Full-size render for a drafted job; returns (image, from_draft).
+        `prepared` is prepare_refine's result (computed here if omitted,
+        raising DraftUnavailable when the draft can't be loaded). Only a
+        backend without img2img renders a plain txt2img instead.
+        """
+        params = entry.params
+        embeds, draft = prepared if prepared is not None else self.prepare_refine(entry)
+        if embeds is None:
+            embeds = self.backend.encode(params["prompt"])
+
+        if draft is not None and self.backend.can_img2img:
+            image = self.backend.img2img(
+                embeds, draft, params["width"], params["height"],
+                params["num_inference_steps"], self.strength,
+                params["guidance_scale"], params["seed"],
+            )
+            return image, True
+
+        image = self.backend.txt2img(
+            embeds, params["width"], params["height"],
+            params["num_inference_steps"], params["guidance_scale"], params["seed"],
+        )
+        return image, False
+
+    def refine_steps(self, params: dict, from_draft: bool) -> int:
+        """Denoising steps a refine actually ran"""
+        steps = params["num_inference_steps"]
+        return max(1, int(steps * self.strength)) if from_draft else steps
+
+    def complete(self, entry: PreviewEntry, image_url: Optional[str]) -> None:
+        """Refine finished: keep only the final URL, release the draft state"""
+        entry.status = REFINED
+        entry.image_url = image_url
+        entry.state = None
+        self.jobs.put(entry)
@@ -0,0 +1,227 @@
+# modal_endpoint/resident_trainer.py
+"""
+In-process ai-toolkit runs that keep the quantized FLUX base in VRAM.
+
+`python run.py config.yaml` loads and quantizes FLUX.1-dev on every call.
+Here the job runs inside the worker process instead, and
+StableDiffusion.load_model is wrapped: the first job loads normally and the
+components it produced (transformer, VAE, text encoders, tokenizers,
+pipeline) are kept; later jobs with the same base get those objects back.
+
+LoRA training patches the base in place: ai-toolkit swaps `forward` on
+every targeted module for the LoRA forward and flips requires_grad. After
+each job `reset()` puts the base back exactly as it was right after
+loading: instance `forward` overrides removed, requires_grad, train/eval
+mode and devices restored, gradients dropped.
+
+With a training monitor, each SDTrainer step's loss is fed to it; when it
+asks to stop, EarlyStop ends the job at the last saved checkpoint.
+
+Patching ai-toolkit internals only holds for a known tree, so install()
+requires the checkout to be the pinned commit (recorded in `.commit` when
+the image is built) and raises UnsupportedToolkit otherwise, including
+when one of the patched attributes has moved; callers fall back to
+`python run.py`.
+"""
+
+import gc
+import os
+import sys
+
+from training_monitor import EarlyStop
+
+TOOLKIT_DIR = "/ai-toolkit"
+
+
+class UnsupportedToolkit(Exception):
+    """The ai-toolkit checkout isn't one the resident patches were written for"""
+
+
+class ResidentBase:
+    def __init__(self, toolkit_dir: str = TOOLKIT_DIR, pinned_commit: str = ""):
+        self.toolkit_dir = toolkit_dir
+        self.pinned_commit = pinned_commit
+        self.key = None
+        self.components: dict = {}
+        self.module_state: list = []
+        self.loads = 0
+        self.reuses = 0
+        self.monitor = None
+
+    def checkout(self) -> str:
+        try:
+            with open(os.path.join(self.toolkit_dir, ".commit")) as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+    def install(self) -> None:
+        """Patch ai-toolkit; raises ImportError or UnsupportedToolkit when it can't"""
+        checkout = self.checkout()
+        if not self.pinned_commit or not checkout.startswith(self.pinned_commit):
+            raise UnsupportedToolkit(
+                f"ai-toolkit at {checkout or 'unknown commit'}, resident mode needs "
+                f"{self.pinned_commit or 'a pinned commit (AI_TOOLKIT_COMMIT)'}"
+            )
+
+        if self.toolkit_dir not in sys.path:
+            sys.path.insert(0, self.toolkit_dir)
+        try:
+            from toolkit.job import get_job  # noqa: F401 - used by run()
+            from toolkit.stable_diffusion_model import StableDiffusion
+
+            original = StableDiffusion.load_model
+        except AttributeError as e:
+            raise UnsupportedToolkit(str(e)) from e
+
+        if getattr(original, "_resident", False):
+            return
+        base = self
+
+        def load_model(sd, *args, **kwargs):
+            key = base.model_key(sd)
+            if key == base.key and base.components:
+                sd.__dict__.update(base.components)
+                base.reuses += 1
+                print("♻️ Reusing resident base model")
+                return
+
+            base.release()
+            before = dict(sd.__dict__)
+            original(sd, *args, **kwargs)
+            base.key = key
+            base.components = {
+                name: value
+                for name, value in sd.__dict__.items()
+                if name not in before or before[name] is not value
+            }
+            base.snapshot()
+            base.loads += 1
+
+        load_model._resident = True
+        StableDiffusion.load_model = load_model
+        self._install_monitor_hook()
+
+    def _install_monitor_hook(self) -> None:
+        try:
+            from extensions_built_in.sd_trainer.SDTrainer import SDTrainer
+
+            original = SDTrainer.hook_train_loop
+        except (ImportError, AttributeError) as e:
+            print(f"   ⚠️ No SDTrainer hook ({e}); early stopping disabled in-process")
+            return
+
+        base = self
+
+        def hook_train_loop(trainer, *args, **kwargs):
+            loss_dict = original(trainer, *args, **kwargs)
+            monitor = base.monitor
+            loss = loss_dict.get("loss") if isinstance(loss_dict, dict) else None
+            if monitor is not None and loss is not None:
+                if monitor.observe(int(trainer.step_num), float(loss)):
+                    raise EarlyStop(f"loss plateaued, checkpoint {monitor.stopped_at}")
+            return loss_dict
+
+        SDTrainer.hook_train_loop = hook_train_loop
+
+    @staticmethod
+    def model_key(sd) -> tuple:
+        config = sd.model_config
+        return (
+            config.name_or_path,
+            bool(getattr(config, "quantize", False)),
+            str(getattr(sd, "torch_dtype", getattr(sd, "dtype", ""))),
+        )
+
+    @property
+    def reused(self) -> bool:
+        return self.reuses > 0
+
+    def _modules(self) -> list:
+        import torch
+
+        found = []
+        for value in self.components.values():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            found.extend(v for v in values if isinstance(v, torch.nn.Module))
+        return found
+
+    def snapshot(self) -> None:
+        """Record the just-loaded state of every module in the base"""
+        self.module_state = []
+        for top in self._modules():
+            param = next(top.parameters(), None)
+            self.module_state.append({
+                "module": top,
+                "training": top.training,
+                "device": param.device if param is not None else None,
+                # Instance forwards that were already there (e.g. accelerate hooks)
+                "forward": {
+                    id(m): m.__dict__["forward"] for m in top.modules() if "forward" in m.__dict__
+                },
+                "requires_grad": [p.requires_grad for p in top.parameters()],
+            })
+
+    def reset(self) -> None:
+        """Undo everything a training job did to the resident base"""
+        import torch
+
+        for state in self.module_state:
+            top = state["module"]
+            for module in top.modules():
+                original = state["forward"].get(id(module))
+                current = module.__dict__.get("forward")
+                if original is None:
+                    if current is not None:
+                        del module.forward
+                elif current is not original:
+                    # A LoRA forward replaced a pre-existing one
+                    module.forward = original
+            for param, requires_grad in zip(top.parameters(), state["requires_grad"]):
+                param.grad = None
+                param.requires_grad_(requires_grad)
+            top.train(state["training"])
+            if state["device"] is not None:
+                top.to(state["device"])
+
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def release(self) -> None:
+        """Drop the resident base, e.g. after a job left it in an unknown state"""
+        self.key = None
+        self.components = {}
+        self.module_state = []
+        gc.collect()
+        try:
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def run(self, config_path, monitor=None) -> None:
+        """Same as `python run.py config_path`, inside this process"""
+        from toolkit.job import get_job
+
+        cwd = os.getcwd()
+        os.chdir(self.toolkit_dir)
+        self.monitor = monitor
+        job = None
+        try:
+            job = get_job(str(config_path), None)
+            job.run()
+            job.cleanup()
+        except EarlyStop as e:
+            # Stopped between steps; reset() detaches the LoRA as after any job
+            print(f"   ⏹️ Early stop: {e}")
+            job.cleanup()
+        except BaseException:
+            # A job that died half way may have left LoRA modules attached
+            self.release()
+            raise
+        finally:
+            self.monitor = None
+            os.chdir(cwd)
@@ -0,0 +1,136 @@
+# modal_endpoint/result_cache.py
+"""
+Cache of finished generations, keyed by the request parameters that fully
+determine the image (prompt, LoRAs, seed, size, steps, guidance, output
+format and quality).
+
+Only seeded requests are cacheable; a hit returns the stored public URL
+without touching the GPU. Storage is a small KV backend so the index can
+live in a modal.Dict, on a Modal volume, or in a plain dict for tests.
+"""
+
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+
+def cache_key(params: dict) -> str:
+    """
+    Canonical hash, independent of key order. Values are hashed as given
+    (`2` and `2.0` differ), so callers normalize numeric types first.
+    """
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class DictBackend:
+    """Any mapping: a modal.Dict in production, a dict locally"""
+
+    def __init__(self, mapping=None):
+        self.mapping = {} if mapping is None else mapping
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.mapping.get(key)
+
+    def put(self, key: str, value: dict) -> None:
+        self.mapping[key] = value
+
+    def delete(self, key: str) -> None:
+        try:
+            del self.mapping[key]
+        except KeyError:
+            pass
+
+
+class FileBackend:
+    """
+    One JSON file per key under `root`, e.g. a directory on a Modal volume.
+    A container only sees other containers' writes after a volume reload,
+    so on a miss `on_miss` (e.g. Volume.reload) runs, at most once every
+    `refresh_every` seconds, and the read is retried.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        on_write: Optional[Callable[[], None]] = None,
+        on_miss: Optional[Callable[[], None]] = None,
+        refresh_every: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.root = Path(root)
+        self.on_write = on_write
+        self.on_miss = on_miss
+        self.refresh_every = refresh_every
+        self.clock = clock
+        self.refreshed_at: Optional[float] = None
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def _read(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self._path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self._read(key)
+        if value is not None or self.on_miss is None:
+            return value
+
+        now = self.clock()
+        if self.refreshed_at is not None and now - self.refreshed_at < self.refresh_every:
+            return None
+        self.refreshed_at = now
+        try:
+            self.on_miss()
+        except Exception as e:
+            print(f"   Result index refresh failed: {e}")
+            return None
+        return self._read(key)
+
+    def put(self, key: str, value: dict) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(value))
+        tmp.replace(path)
+        if self.on_write:
+            self.on_write()
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+
+class ResultCache:
+    def __init__(self, backend, ttl: float = 7 * 24 * 3600, clock: Callable[[], float] = time.time):
+        self.backend = backend
+        self.ttl = ttl
+        self.clock = clock
+
+    def get(self, params: dict) -> Optional[str]:
+        key = cache_key(params)
+        try:
+            entry = self.backend.get(key)
+            if entry and entry.get("expires_at", 0) < self.clock():
+                self.backend.delete(key)
+                entry = None
+        except Exception as e:
+            print(f"   Result cache unavailable: {e}")
+            return None
+
+        return entry.get("image_url") if entry else None
+
+    def put(self, params: dict, image_url: str) -> None:
+        now = self.clock()
+        try:
+            self.backend.put(cache_key(params), {
+                "image_url": image_url,
+                "created_at": now,
+                "expires_at": now + self.ttl,
+            })
+        except Exception as e:
+            print(f"   Could not store result in cache: {e}")
@@ -0,0 +1,58 @@
+# modal_endpoint/startup.py
+"""
+Phase timing for container start-up.
+
+Each phase (HF login, CPU weight load, GPU move, ...) is timed and logged so
+cold-start regressions show up in the Modal logs and in the CPU benchmark.
+`load_pretrained` is the one from_pretrained call both of them use.
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    def __init__(self, label: str = "startup"):
+        self.label = label
+        self.phases: dict = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            print(f"   ⏱ {self.label}.{name}: {elapsed:.2f}s")
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def report(self) -> dict:
+        return {
+            "label": self.label,
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "total": round(self.total, 4),
+        }
+
+
+def load_pretrained(cls, repo: str, cache_dir: str, torch_dtype, **extra):
+    """
+    `cls.from_pretrained` the way the inference container loads FLUX: from
+    the local cache only (no Hub round trips) when it has the weights,
+    otherwise from the Hub
+    """
+    kwargs = dict(
+        torch_dtype=torch_dtype,
+        cache_dir=cache_dir,
+        # Both are diffusers defaults; pinned so a default change can't slip in
+        use_safetensors=True,
+        low_cpu_mem_usage=True,
+        **extra,
+    )
+    try:
+        return cls.from_pretrained(repo, local_files_only=True, **kwargs)
+    except (OSError, ValueError):
+        return cls.from_pretrained(repo, **kwargs)
@@ -0,0 +1,142 @@
+# modal_endpoint/tests/test_lora_adapters.py
+"""
+AdapterRegistry planning against a stub pipeline, and FusePolicy's
+fuse / unfuse / beside decisions.
+"""
+
+from lora_adapters import BESIDE, FUSED, UNFUSED, AdapterRegistry, AdapterSpec, FusePolicy
+
+
+class StubPipe:
+    def __init__(self):
+        self.calls = []
+
+    def load_lora_weights(self, path, adapter_name):
+        self.calls.append(("load", adapter_name))
+
+    def set_adapters(self, names, adapter_weights):
+        self.calls.append(("set", tuple(names), tuple(adapter_weights)))
+
+    def delete_adapters(self, names):
+        self.calls.append(("delete", tuple(names)))
+
+
+def registry(max_loaded=2):
+    return AdapterRegistry(StubPipe(), download=lambda url, path: path.write_bytes(b""),
+                           max_loaded=max_loaded)
+
+
+A = AdapterSpec("https://lora/a")
+B = AdapterSpec("https://lora/b")
+C = AdapterSpec("https://lora/c")
+
+
+def test_plan_loads_new_adapters_and_sets_weights():
+    plan = registry().plan([A])
+
+    assert plan["load"] == [A]
+    assert plan["evict"] == []
+    assert plan["set_weights"]
+
+
+def test_plan_is_empty_for_the_active_set():
+    adapters = registry()
+    adapters.apply([A])
+
+    assert adapters.plan([A]) == {"load": [], "evict": [], "set_weights": False}
+
+
+def test_plan_only_reweights_on_a_scale_change():
+    adapters = registry()
+    adapters.apply([A])
+
+    plan = adapters.plan([AdapterSpec(A.url, 0.5)])
+
+    assert plan["load"] == [] and plan["evict"] == []
+    assert plan["set_weights"]
+
+
+def test_plan_evicts_least_recently_used():
+    adapters = registry(max_loaded=2)
+    adapters.apply([A])
+    adapters.apply([B])
+
+    assert adapters.plan([C])["evict"] == [A.name]
+
+
+def test_plan_never_evicts_pinned_adapters():
+    adapters = registry(max_loaded=2)
+    adapters.apply([A])
+    adapters.apply([B])
+
+    assert adapters.plan([C], pinned=[A.name])["evict"] == [B.name]
+
+
+def decide_many(policy, keys):
+    decisions = []
+    for key in keys:
+        decision = policy.decide(key)
+        if decision["unfuse"]:
+            policy.fused_key = None
+        if decision["fuse"]:
+            policy.fused_key = key
+        decisions.append(decision)
+    return decisions
+
+
+HOT = (("hot", 1.0),)
+COLD = (("cold", 1.0),)
+
+
+def test_fuses_once_a_set_is_hot():
+    policy = FusePolicy(threshold=0.6, window=10, min_requests=5)
+
+    decisions = decide_many(policy, [HOT] * 4)
+    assert not any(d["fuse"] for d in decisions)
+
+    assert policy.decide(HOT)["fuse"]
+
+
+def test_other_sets_run_beside_a_fused_set():
+    policy = FusePolicy(threshold=0.6, window=10, min_requests=5)
+    decide_many(policy, [HOT] * 6)
+
+    # 70/30 traffic never evicts the hot set
+    decisions = decide_many(policy, [HOT, COLD, HOT, HOT, COLD, HOT, HOT, COLD, HOT, HOT])
+    assert not any(d["unfuse"] for d in decisions)
+    assert [d["beside"] for d in decisions].count(True) == 3
+    assert policy.fused_key == HOT
+
+
+def test_unfuses_when_the_fused_set_cools_down():
+    policy = FusePolicy(threshold=0.6, window=10, min_requests=5, release_threshold=0.4)
+    decide_many(policy, [HOT] * 10)
+
+    decisions = decide_many(policy, [(("other", float(i)),) for i in range(7)])
+
+    # Share of HOT falls to 0.3 at the 7th other request
+    assert [d["unfuse"] for d in decisions].index(True) == 6
+    assert policy.fused_key is None
+
+
+def test_a_newly_hot_set_takes_over():
+    policy = FusePolicy(threshold=0.5, window=10, min_requests=5, release_threshold=0.2)
+    decide_many(policy, [HOT] * 10)
+
+    decisions = decide_many(policy, [COLD] * 5)
+
+    assert decisions[-1] == {"unfuse": True, "fuse": True, "beside": False}
+    assert policy.fused_key == COLD
+
+
+def test_speed_is_booked_per_path():
+    policy = FusePolicy()
+    policy.record(FUSED, 28, 7.0)
+    policy.record(UNFUSED, 28, 14.0)
+    policy.record(BESIDE, 28, 28.0)
+
+    summary = policy.summary()
+
+    assert summary["fused_steps_per_sec"] == 4.0
+    assert summary["unfused_steps_per_sec"] == 2.0
+    assert summary["beside_steps_per_sec"] == 1.0
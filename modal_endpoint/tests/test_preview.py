@@ -0,0 +1,151 @@
+# modal_endpoint/tests/test_preview.py
+"""
+Draft → refine state machine against a mock pipeline, with job records
+shared between "containers" through a DictBackend.
+"""
+
+import pytest
+
+from preview import DRAFTED, REFINED, DraftUnavailable, PreviewJobs, PreviewRunner, draft_size
+from result_cache import DictBackend
+
+PARAMS = {
+    "prompt": "ohwx portrait",
+    "loras": [["https://lora/a", 1.0]],
+    "seed": 7,
+    "width": 1024,
+    "height": 768,
+    "num_inference_steps": 28,
+    "guidance_scale": 3.5,
+    "output_format": "jpeg",
+    "output_quality": 90,
+}
+
+
+class MockPipeline:
+    """Records calls; images are tuples describing how they were made"""
+
+    def __init__(self, uploads=None, can_img2img=True):
+        self.uploads = {} if uploads is None else uploads
+        self.can_img2img = can_img2img
+        self.calls = []
+
+    def encode(self, prompt):
+        self.calls.append("encode")
+        return ("embeds", prompt)
+
+    def txt2img(self, embeds, width, height, steps, guidance, seed):
+        self.calls.append(("txt2img", width, height, steps))
+        return ("txt2img", width, height, seed)
+
+    def img2img(self, embeds, image, width, height, steps, strength, guidance, seed):
+        self.calls.append(("img2img", width, height, steps, strength))
+        return ("img2img", image, width, height)
+
+    def fetch(self, url):
+        self.calls.append(("fetch", url))
+        return self.uploads.get(url)
+
+
+def container(shared, uploads=None, clock=lambda: 0.0, **kwargs):
+    pipeline = MockPipeline(uploads, **kwargs)
+    jobs = PreviewJobs(DictBackend(shared), ttl=3600.0, clock=clock)
+    runner = PreviewRunner(pipeline, jobs, draft_steps=8, draft_long_side=512, strength=0.5,
+                           fetch_delay=0.0, sleep=lambda seconds: None)
+    return runner, pipeline
+
+
+def test_draft_is_small_and_fast():
+    runner, pipeline = container({})
+
+    image, entry = runner.draft("job", PARAMS, draft_url="https://drafts/job.jpeg")
+
+    assert draft_size(1024, 768, 512) == (512, 384)
+    assert pipeline.calls == ["encode", ("txt2img", 512, 384, 8)]
+    assert entry.status == DRAFTED
+    assert entry.state == (("embeds", PARAMS["prompt"]), image)
+
+
+def test_local_refine_reuses_embeddings_and_draft():
+    runner, pipeline = container({})
+    draft, entry = runner.draft("job", PARAMS)
+    pipeline.calls.clear()
+
+    image, from_draft = runner.refine(runner.jobs.get("job"))
+
+    assert from_draft
+    assert image == ("img2img", draft, 1024, 768)
+    assert pipeline.calls == [("img2img", 1024, 768, 28, 0.5)]
+    assert runner.refine_steps(entry.params, from_draft) == 14
+
+
+def test_cross_container_refine_starts_from_the_uploaded_draft():
+    shared, uploads = {}, {}
+    first, _ = container(shared, uploads)
+    draft, _ = first.draft("job", PARAMS, draft_url="https://drafts/job.jpeg")
+    uploads["https://drafts/job.jpeg"] = draft
+
+    second, pipeline = container(shared, uploads)
+    entry = second.jobs.get("job")
+    assert entry is not None and entry.state is None
+
+    prepared = second.prepare_refine(entry)
+    image, from_draft = second.refine(entry, prepared)
+
+    assert from_draft
+    assert image[1] == draft
+    assert pipeline.calls[0] == ("fetch", "https://drafts/job.jpeg")
+    assert "encode" in pipeline.calls
+
+
+def test_missing_upload_is_retryable_not_a_different_image():
+    shared = {}
+    first, _ = container(shared)
+    first.draft("job", PARAMS, draft_url="https://drafts/job.jpeg")
+
+    second, pipeline = container(shared)
+    with pytest.raises(DraftUnavailable):
+        second.prepare_refine(second.jobs.get("job"))
+
+    assert pipeline.calls.count(("fetch", "https://drafts/job.jpeg")) == 3
+    assert not any(call[0] == "txt2img" for call in pipeline.calls if isinstance(call, tuple))
+
+
+def test_backend_without_img2img_renders_from_scratch():
+    runner, pipeline = container({}, can_img2img=False)
+    runner.draft("job", PARAMS)
+
+    image, from_draft = runner.refine(runner.jobs.get("job"))
+
+    assert not from_draft
+    assert image[0] == "txt2img"
+
+
+def test_expired_jobs_are_dropped_everywhere():
+    now = [0.0]
+    shared = {}
+    runner, _ = container(shared, clock=lambda: now[0])
+    runner.draft("job", PARAMS)
+
+    now[0] = 3601.0
+    assert runner.jobs.get("job") is None
+    assert "job" not in shared
+    assert "job" not in runner.jobs.local
+
+
+def test_refine_after_complete_keeps_only_the_final_url():
+    shared = {}
+    runner, _ = container(shared)
+    _, entry = runner.draft("job", PARAMS)
+
+    runner.complete(entry, "https://images/final.jpeg")
+
+    assert entry.state is None
+    assert shared["job"]["status"] == REFINED
+    assert shared["job"]["image_url"] == "https://images/final.jpeg"
+
+    # Another container sees the finished job and can return the URL as is
+    other, _ = container(shared)
+    finished = other.jobs.get("job")
+    assert finished.status == REFINED
+    assert finished.image_url == "https://images/final.jpeg"
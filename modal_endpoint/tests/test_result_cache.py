@@ -0,0 +1,26 @@
+# modal_endpoint/tests/test_result_cache.py
+"""
+Cache keys and expiry over a DictBackend.
+"""
+
+from result_cache import DictBackend, ResultCache, cache_key
+
+PARAMS = {"prompt": "ohwx", "seed": 7, "width": 1024, "guidance_scale": 3.5}
+
+
+def test_key_ignores_order_but_not_numeric_type():
+    assert cache_key(PARAMS) == cache_key(dict(reversed(list(PARAMS.items()))))
+    # Callers normalize: 1024 and 1024.0 are different keys
+    assert cache_key(PARAMS) != cache_key({**PARAMS, "width": 1024.0})
+
+
+def test_hit_until_expiry():
+    now = [0.0]
+    cache = ResultCache(DictBackend(), ttl=60.0, clock=lambda: now[0])
+    cache.put(PARAMS, "https://images/a.png")
+
+    assert cache.get(dict(PARAMS)) == "https://images/a.png"
+    assert cache.get({**PARAMS, "seed": 8}) is None
+
+    now[0] = 61.0
+    assert cache.get(PARAMS) is None
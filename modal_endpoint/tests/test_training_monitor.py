@@ -0,0 +1,101 @@
+# modal_endpoint/tests/test_training_monitor.py
+"""
+Replays the loss curves in curves/ through the plateau monitor.
+
+    fast-plateau.txt    converges by ~step 200, then only noise
+    slow-converge.txt   still improving at step 500
+    bare-with-nan.txt   one loss per line, with a NaN and a spike
+"""
+
+import math
+import os
+
+from training_monitor import PlateauMonitor, _replay, step_budget
+
+CURVES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "curves")
+
+
+def curve(name: str) -> str:
+    return os.path.join(CURVES, name)
+
+
+def load(name: str) -> list:
+    with open(curve(name)) as f:
+        return [tuple(line.split()) for line in f if line.strip()]
+
+
+def test_plateau_stops_at_a_checkpoint():
+    report = _replay(curve("fast-plateau.txt"), budget=500, every=50)
+
+    assert report["stopped_early"]
+    assert report["checkpoint_step"] % 50 == 0
+    assert report["checkpoint_step"] < report["steps_run"] < 500
+    # One unit of time per step in a replay
+    assert report["gpu_seconds_saved"] == 500 - report["steps_run"]
+
+
+def test_checkpoint_interval_sets_the_stop_point():
+    every_50 = _replay(curve("fast-plateau.txt"), budget=500, every=50)
+    every_100 = _replay(curve("fast-plateau.txt"), budget=500, every=100)
+
+    assert every_100["checkpoint_step"] % 100 == 0
+    assert every_100["checkpoint_step"] <= every_50["checkpoint_step"]
+
+
+def test_converging_curve_runs_the_full_budget():
+    report = _replay(curve("slow-converge.txt"), budget=500, every=50)
+
+    assert not report["stopped_early"]
+    assert report["checkpoint_step"] is None
+    assert report["steps_run"] == 500
+    assert report["gpu_seconds_saved"] == 0
+
+
+def test_budget_truncates_the_replay():
+    report = _replay(curve("slow-converge.txt"), budget=200, every=50)
+
+    assert report["steps_run"] == 200
+    assert report["steps_requested"] == 200
+
+
+def test_bare_losses_skip_nan():
+    report = _replay(curve("bare-with-nan.txt"), budget=500, every=50)
+
+    assert report["smoothed_loss"] is not None
+    assert math.isfinite(report["smoothed_loss"])
+    assert report["stopped_early"]
+
+
+def test_no_stop_without_a_checkpoint_at_or_after_the_best_step():
+    never_saved = PlateauMonitor(500)
+    tracking_only = PlateauMonitor(500, checkpoint=lambda: 500, stop=False)
+
+    for step, loss in load("fast-plateau.txt"):
+        assert not never_saved.observe(int(step), float(loss))
+        assert not tracking_only.observe(int(step), float(loss))
+
+    # Both saw the plateau; one had no checkpoint, the other only tracks
+    assert never_saved.plateau_step is not None
+    assert tracking_only.plateau_step is not None
+    assert not never_saved.stopped_early and not tracking_only.stopped_early
+
+
+def test_step_budget_scales_with_images():
+    assert step_budget(3, 1000) == 200
+    assert step_budget(10, 1000) == 400
+    assert step_budget(50, 1000) == 1000
+
+
+def test_checkpoint_at_the_current_step_is_not_trusted():
+    # The save for the step being reported may still be on its way to disk
+    saved = {"step": None}
+    monitor = PlateauMonitor(300, checkpoint=lambda: saved["step"], patience=10, min_steps=0)
+
+    for step in range(1, 200):
+        saved["step"] = step if step >= 150 else None
+        assert not monitor.observe(step, 0.5)
+    assert monitor.plateau_step is not None
+
+    saved["step"] = 199
+    assert monitor.observe(200, 0.5)
+    assert monitor.stopped_at == 199
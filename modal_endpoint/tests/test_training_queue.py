@@ -0,0 +1,135 @@
+# modal_endpoint/tests/test_training_queue.py
+"""
+Queue worker with a plain queue.Queue and a stub trainer, plus the spawn
+rule and worker leases.
+"""
+
+import queue
+
+from training_queue import TrainingJob, TrainingWorker, WorkerLeases, queue_puller, should_spawn_worker
+
+
+def job(character_id: str, **overrides) -> dict:
+    data = TrainingJob(character_id, f"name-{character_id}", ["u"] * 5, "https://hook", enqueued_at=0.0)
+    return {**data.as_dict(), **overrides}
+
+
+def make_worker(items, train=None, reset=lambda: None, max_jobs=8):
+    q = queue.Queue()
+    for item in items:
+        q.put(item)
+    notified = []
+    worker = TrainingWorker(
+        pull=queue_puller(q),
+        train=train or (lambda j: {"model_url": f"https://lora/{j.character_id}"}),
+        notify=lambda url, payload: notified.append(payload),
+        reset=reset,
+        max_jobs=max_jobs,
+        idle_timeout=0.01,
+        clock=lambda: 10.0,
+    )
+    return worker, q, notified
+
+
+def test_trains_queued_jobs_back_to_back():
+    worker, q, notified = make_worker([job("a"), job("b")])
+
+    results = worker.run()
+
+    assert [r["character_id"] for r in results] == ["a", "b"]
+    assert all(r["success"] for r in results)
+    assert [p["worker_job"] for p in notified] == [1, 2]
+    assert notified[0]["model_url"] == "https://lora/a"
+    assert notified[0]["queue_seconds"] == 10.0
+    assert q.empty()
+
+
+def test_failed_job_is_reported_and_the_worker_continues():
+    def train(j):
+        if j.character_id == "bad":
+            raise RuntimeError("no faces")
+        return {"model_url": "ok"}
+
+    resets = []
+    worker, _, notified = make_worker([job("bad"), job("good")], train=train,
+                                      reset=lambda: resets.append(1))
+
+    results = worker.run()
+
+    assert [r["success"] for r in results] == [False, True]
+    assert notified[0]["status"] == "failed"
+    assert notified[0]["error"] == "no faces"
+    assert len(resets) == 2
+
+
+def test_malformed_job_is_skipped():
+    worker, _, notified = make_worker([{"character_id": "x"}, job("a")])
+
+    results = worker.run()
+
+    assert [r["character_id"] for r in results] == ["a"]
+    assert len(notified) == 1
+
+
+def test_stops_after_max_jobs_and_leaves_the_rest_queued():
+    worker, q, _ = make_worker([job(str(i)) for i in range(5)], max_jobs=3)
+
+    assert len(worker.run()) == 3
+    assert q.qsize() == 2
+
+
+def test_reset_failure_stops_the_worker():
+    def reset():
+        raise RuntimeError("base left dirty")
+
+    worker, q, notified = make_worker([job("a"), job("b")], reset=reset)
+
+    results = worker.run()
+
+    # The job itself still finished and was reported
+    assert len(results) == 1 and results[0]["success"]
+    assert len(notified) == 1
+    assert not worker.healthy
+    assert q.qsize() == 1
+
+
+def test_spawn_follows_backlog_per_live_worker():
+    assert should_spawn_worker(1, 0, 8)
+    assert not should_spawn_worker(0, 0, 8)
+    # A steady trickle stays on the live worker
+    assert not should_spawn_worker(1, 1, 8)
+    assert not should_spawn_worker(8, 1, 8)
+    assert should_spawn_worker(9, 1, 8)
+    assert not should_spawn_worker(16, 2, 8)
+    assert should_spawn_worker(17, 2, 8)
+
+
+def test_spawn_respects_the_worker_limit():
+    assert not should_spawn_worker(100, 4, 8, limit=4)
+    assert should_spawn_worker(100, 3, 8, limit=4)
+
+
+def test_leases_expire_without_renewal():
+    now = [0.0]
+    leases = WorkerLeases({}, ttl=180.0, clock=lambda: now[0])
+
+    leases.renew("starting", ttl=600.0)
+    leases.renew("running")
+    assert leases.active() == 2
+
+    now[0] = 200.0
+    leases.renew("running")
+    assert leases.active() == 2
+
+    # "running" crashed without releasing; "starting" never came up
+    now[0] = 700.0
+    assert leases.active() == 0
+    assert leases.mapping == {}
+
+
+def test_release_drops_the_lease():
+    leases = WorkerLeases({}, clock=lambda: 0.0)
+    leases.renew("w")
+    leases.release("w")
+    leases.release("w")
+    assert leases.active() == 0
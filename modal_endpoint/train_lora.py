@@ -6,9 +6,18 @@ FLUX LoRA Training - Using ai-toolkit with fixed numpy
 import modal
 import os
 import subprocess
+import uuid
+
+from training_monitor import CHECK_EVERY, PlateauMonitor, checkpoint_step, parse_progress, step_budget
+from training_queue import TrainingJob, WorkerLeases, should_spawn_worker
 
 app = modal.App("carmi-flux-lora-training")
 
+# ai-toolkit commit (full or abbreviated SHA) the image is built from. The
+# queue worker's in-process mode patches ai-toolkit internals and only runs
+# against this checkout; unpinned images train through run.py subprocesses
+AI_TOOLKIT_COMMIT = os.environ.get("AI_TOOLKIT_COMMIT", "")
+
 training_image = (
     modal.Image.from_registry(
         "nvidia/cuda:12.4.1-devel-ubuntu22.04",
@@ -54,6 +63,7 @@ training_image = (
         "python -c 'import numpy; print(f\"NumPy: {numpy.__version__}\")'",
         # Clone ai-toolkit
         "git clone https://github.com/ostris/ai-toolkit.git /ai-toolkit",
+        f"cd /ai-toolkit && git checkout {AI_TOOLKIT_COMMIT or 'HEAD'} && git rev-parse HEAD > .commit",
         # Install ai-toolkit deps without reinstalling numpy
         "cd /ai-toolkit && pip install -r requirements.txt --no-deps || true",
         "pip install lycoris-lora>=2.0.0 --no-deps || true",
@@ -62,10 +72,367 @@ training_image = (
         # Final numpy check
         "pip install 'numpy==1.26.4' --force-reinstall",
     )
+    # The container re-imports this module and must see the same pin
+    .env({"AI_TOOLKIT_COMMIT": AI_TOOLKIT_COMMIT})
 )
 
 model_cache = modal.Volume.from_name("flux-model-cache", create_if_missing=True)
 
+# Characters waiting for a training worker (LORA_TRAINING_MODE=queue)
+training_jobs = modal.Queue.from_name("carmi-lora-training-jobs", create_if_missing=True)
+# Live workers (worker id -> lease expiry), so spawning follows the backlog per worker
+worker_leases = WorkerLeases(modal.Dict.from_name("carmi-lora-training-workers", create_if_missing=True))
+
+TRAINING_MODE = os.environ.get("LORA_TRAINING_MODE", "spawn")
+WORKER_MAX_JOBS = int(os.environ.get("LORA_WORKER_MAX_JOBS", "8"))
+WORKER_IDLE_TIMEOUT = float(os.environ.get("LORA_WORKER_IDLE_TIMEOUT", "60"))
+WORKER_LIMIT = int(os.environ.get("LORA_WORKER_LIMIT", "4"))
+# How long a spawned worker counts as live before it renews its own lease
+WORKER_START_TTL = float(os.environ.get("LORA_WORKER_START_TTL", "600"))
+
+# Defaults for requests that don't set early_stop / adaptive_steps
+EARLY_STOP = os.environ.get("LORA_EARLY_STOP", "0") == "1"
+ADAPTIVE_STEPS = os.environ.get("LORA_ADAPTIVE_STEPS", "0") == "1"
+
+TRIGGER = "ohwx"
+TOOLKIT_ENV = {
+    "HF_HOME": "/cache",
+    "TRANSFORMERS_CACHE": "/cache",
+    "TORCH_HOME": "/cache/torch",
+}
+
+local_modules = modal.Mount.from_local_python_packages(
+    "training_monitor", "training_queue", "resident_trainer",
+)
+
+
+def setup_environment():
+    import torch
+    from huggingface_hub import login
+
+    os.environ.update(TOOLKIT_ENV)
+
+    hf_token = os.environ.get("HF_TOKEN")
+    if hf_token:
+        login(token=hf_token)
+
+    print(f"   PyTorch: {torch.__version__}")
+    print(f"   CUDA: {torch.cuda.get_device_name(0)}")
+
+    import numpy as np
+    print(f"   NumPy: {np.__version__}")
+    
+    # Verify numpy is 1.x
+    if not np.__version__.startswith("1."):
+        print(f"   ⚠️ WARNING: NumPy {np.__version__} may cause issues!")
+
+
+def prepare_images(image_urls: list, img_dir, trigger: str = TRIGGER) -> int:
+    """Download, center-crop and caption up to 20 images; returns the count"""
+    import requests
+    from PIL import Image
+    from io import BytesIO
+
+    print("\n📥 Downloading images...")
+    count = 0
+    for i, url in enumerate(image_urls[:20]):
+        try:
+            r = requests.get(url, timeout=60)
+            r.raise_for_status()
+            img = Image.open(BytesIO(r.content)).convert("RGB")
+
+            w, h = img.size
+            s = min(w, h)
+            left, top = (w - s) // 2, (h - s) // 2
+            img = img.crop((left, top, left + s, top + s))
+            img = img.resize((512, 512), Image.Resampling.LANCZOS)
+
+            img.save(img_dir / f"{count:03d}.jpg", quality=95)
+            (img_dir / f"{count:03d}.txt").write_text(f"photo of {trigger} person")
+
+            count += 1
+            print(f"   ✓ {count}")
+        except Exception as e:
+            print(f"   ✗ {e}")
+
+    if count < 5:
+        raise ValueError(f"Need ≥5 images, got {count}")
+
+    print(f"\n📸 {count} images ready")
+    return count
+
+
+def build_config(
+    character_id: str,
+    character_name: str,
+    img_dir,
+    out_dir,
+    steps: int,
+    lr: float,
+    rank: int,
+    trigger: str = TRIGGER,
+    save_every: int = None,
+) -> dict:
+    return {
+        "job": "extension",
+        "config": {
+            "name": f"lora_{character_id[:8]}",
+            "process": [
+                {
+                    "type": "sd_trainer",
+                    "training_folder": str(out_dir),
+                    "device": "cuda:0",
+                    "trigger_word": trigger,
+                    "network": {
+                        "type": "lora",
+                        "linear": rank,
+                        "linear_alpha": rank,
+                    },
+                    "save": {
+                        "dtype": "float16",
+                        "save_every": save_every or steps,
+                        "max_step_saves_to_keep": 1,
+                    },
+                    "datasets": [
+                        {
+                            "folder_path": str(img_dir),
+                            "caption_ext": "txt",
+                            "caption_dropout_rate": 0.05,
+                            "shuffle_tokens": False,
+                            "cache_latents_to_disk": True,
+                            "resolution": [512, 512],
+                        }
+                    ],
+                    "train": {
+                        "batch_size": 1,
+                        "steps": steps,
+                        "gradient_accumulation_steps": 1,
+                        "train_unet": True,
+                        "train_text_encoder": False,
+                        "gradient_checkpointing": True,
+                        "noise_scheduler": "flowmatch",
+                        "optimizer": "adamw8bit",
+                        "lr": lr,
+                        "ema_config": {"use_ema": False},
+                        "dtype": "bf16",
+                    },
+                    "model": {
+                        "name_or_path": "black-forest-labs/FLUX.1-dev",
+                        "is_flux": True,
+                        "quantize": True,
+                    },
+                    "sample": {
+                        "sampler": "flowmatch",
+                        "sample_every": steps + 100,
+                        "width": 512,
+                        "height": 512,
+                        "prompts": [],
+                        "neg": "",
+                        "seed": 42,
+                        "walk_seed": True,
+                        "guidance_scale": 4,
+                        "sample_steps": 20,
+                    },
+                }
+            ],
+        },
+        "meta": {
+            "name": f"[lora] {character_name}",
+            "version": "1.0",
+        },
+    }
+
+
+def run_toolkit(config_path, monitor=None) -> None:
+    """
+    Train with `python /ai-toolkit/run.py`; loads the base from scratch
+    Progress lines go to `monitor`, which can end the run at a checkpoint
+    """
+    from collections import deque
+
+    proc = subprocess.Popen(
+        ["python", "/ai-toolkit/run.py", str(config_path)],
+        cwd="/ai-toolkit",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        env={**os.environ, **TOOLKIT_ENV},
+    )
+
+    # tqdm redraws become lines here; keep only the latest one in the log tail
+    tail = deque(maxlen=60)
+    last_progress = None
+    stopped = False
+    for line in proc.stdout:
+        line = line.rstrip()
+        if not line:
+            continue
+        progress = parse_progress(line)
+        if progress is None:
+            tail.append(line)
+            continue
+        last_progress = line
+        if monitor and monitor.observe(progress[0], progress[2]):
+            print(f"   ⏹️ Loss plateaued at step {progress[0]}; keeping checkpoint {monitor.stopped_at}")
+            stopped = True
+            proc.terminate()
+            break
+    proc.stdout.close()
+
+    try:
+        proc.wait(timeout=120)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+    print("OUTPUT (last 60 lines):")
+    for line in tail:
+        print(line)
+    if last_progress:
+        print(last_progress)
+
+    if proc.returncode != 0 and not stopped:
+        raise RuntimeError(f"Training failed with code {proc.returncode}")
+
+
+def latest_checkpoint(out_dir):
+    """Step of the newest intermediate save under out_dir, or None"""
+    steps = [checkpoint_step(p.name) for p in out_dir.rglob("*.safetensors")]
+    steps = [step for step in steps if step is not None]
+    return max(steps) if steps else None
+
+
+def find_lora(out_dir, search_root=None, step=None):
+    """Newest LoRA file; with `step`, the checkpoint an early stop ended on"""
+    from pathlib import Path
+
+    lora_files = list(out_dir.rglob("*.safetensors"))
+    if step is not None:
+        # Never the newest file here: a later save may have been cut off by the stop
+        matching = [p for p in lora_files if checkpoint_step(p.name) == step]
+        if not matching:
+            raise RuntimeError(f"Checkpoint for step {step} not found")
+        lora_files = matching
+    if not lora_files and search_root:
+        lora_files = list(Path(search_root).rglob("*.safetensors"))
+
+    if not lora_files:
+        raise RuntimeError("No LoRA file found")
+
+    # Final save (or the requested checkpoint)
+    lora_path = max(lora_files, key=lambda p: p.stat().st_mtime)
+    print(f"\n💾 LoRA: {lora_path} ({lora_path.stat().st_size / 1e6:.1f} MB)")
+    return lora_path
+
+
+def upload_lora(lora_path, character_id: str) -> str:
+    """Upload to the Supabase `loras` bucket; returns the public URL"""
+    import requests
+
+    supabase_url = os.environ["SUPABASE_URL"]
+    supabase_key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+
+    print("\n☁️ Uploading...")
+    with open(lora_path, "rb") as f:
+        data = f.read()
+
+    path = f"{character_id}/lora.safetensors"
+    url = f"{supabase_url}/storage/v1/object/loras/{path}"
+
+    r = requests.post(
+        url,
+        headers={
+            "Authorization": f"Bearer {supabase_key}",
+            "Content-Type": "application/octet-stream",
+            "x-upsert": "true",
+        },
+        data=data,
+        timeout=300,
+    )
+
+    if r.status_code not in (200, 201):
+        requests.post(
+            f"{supabase_url}/storage/v1/bucket",
+            headers={"Authorization": f"Bearer {supabase_key}", "Content-Type": "application/json"},
+            json={"id": "loras", "name": "loras", "public": True},
+        )
+        r = requests.post(url, headers={
+            "Authorization": f"Bearer {supabase_key}",
+            "Content-Type": "application/octet-stream",
+            "x-upsert": "true",
+        }, data=data, timeout=300)
+
+    model_url = f"{supabase_url}/storage/v1/object/public/loras/{path}"
+    print(f"   ✅ {model_url}")
+    return model_url
+
+
+def notify_webhook(webhook_url: str, payload: dict) -> None:
+    import requests
+
+    requests.post(webhook_url, json=payload, timeout=30)
+
+
+def train_character(
+    character_id: str,
+    character_name: str,
+    image_urls: list,
+    work_dir,
+    steps: int,
+    lr: float,
+    rank: int,
+    run=run_toolkit,
+    search_root=None,
+    early_stop: bool = False,
+    adaptive_steps: bool = False,
+) -> dict:
+    """
+    Images → ai-toolkit run → uploaded LoRA; returns the webhook fields
+    adaptive_steps caps `steps` by dataset size; early_stop saves every
+    CHECK_EVERY steps and ends the run once the loss plateaus
+    """
+    import time
+    import yaml
+
+    img_dir = work_dir / "images"
+    img_dir.mkdir(parents=True, exist_ok=True)
+    out_dir = work_dir / "output"
+    out_dir.mkdir(exist_ok=True)
+
+    count = prepare_images(image_urls, img_dir)
+
+    budget = step_budget(count, steps) if adaptive_steps else steps
+    monitor = None
+    if early_stop or adaptive_steps:
+        monitor = PlateauMonitor(
+            budget, requested=steps, checkpoint=lambda: latest_checkpoint(out_dir), stop=early_stop,
+        )
+    if budget != steps:
+        print(f"   Step budget: {budget} for {count} images (requested {steps})")
+
+    config = build_config(
+        character_id, character_name, img_dir, out_dir, budget, lr, rank,
+        save_every=min(CHECK_EVERY, budget) if early_stop else budget,
+    )
+    config_path = work_dir / "config.yaml"
+    with open(config_path, "w") as f:
+        yaml.dump(config, f, default_flow_style=False)
+
+    print("\n🏋️ Starting training...")
+    started = time.monotonic()
+    run(config_path, monitor)
+    train_seconds = time.monotonic() - started
+
+    stopped_at = monitor.stopped_at if monitor else None
+    lora_path = find_lora(out_dir, search_root, step=stopped_at)
+    model_url = upload_lora(lora_path, character_id)
+
+    result = {"model_url": model_url, "trigger_word": TRIGGER}
+    if monitor:
+        result["training"] = monitor.summary(train_seconds)
+        print(f"   ⏱️ {result['training']}")
+    return result
+
 
 @app.function(
     image=training_image,
@@ -76,6 +443,7 @@ model_cache = modal.Volume.from_name("flux-model-cache", create_if_missing=True)
         modal.Secret.from_name("supabase-secret"),
     ],
     volumes={"/cache": model_cache},
+    mounts=[local_modules],
 )
 def train_lora(
     character_id: str,
@@ -85,252 +453,153 @@ def train_lora(
     steps: int = 500,
     lr: float = 1e-4,
     rank: int = 16,
+    early_stop: bool = EARLY_STOP,
+    adaptive_steps: bool = ADAPTIVE_STEPS,
 ):
-    import torch
-    import requests
-    import yaml
     from pathlib import Path
-    from PIL import Image
-    from io import BytesIO
-    from huggingface_hub import login
-
-    os.environ["HF_HOME"] = "/cache"
-    os.environ["TRANSFORMERS_CACHE"] = "/cache"
-    os.environ["TORCH_HOME"] = "/cache/torch"
-
-    hf_token = os.environ.get("HF_TOKEN")
-    if hf_token:
-        login(token=hf_token)
-
-    supabase_url = os.environ["SUPABASE_URL"]
-    supabase_key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
 
     print(f"🚀 Training LoRA for: {character_name}")
-    print(f"   PyTorch: {torch.__version__}")
-    print(f"   CUDA: {torch.cuda.get_device_name(0)}")
     print(f"   Steps: {steps}, LR: {lr}, Rank: {rank}")
-
-    import numpy as np
-    print(f"   NumPy: {np.__version__}")
-    
-    # Verify numpy is 1.x
-    if not np.__version__.startswith("1."):
-        print(f"   ⚠️ WARNING: NumPy {np.__version__} may cause issues!")
+    setup_environment()
 
     work_dir = Path("/tmp/training")
     work_dir.mkdir(exist_ok=True)
-    img_dir = work_dir / "images"
-    img_dir.mkdir(exist_ok=True)
-    out_dir = work_dir / "output"
-    out_dir.mkdir(exist_ok=True)
-
-    trigger = "ohwx"
 
     try:
-        # Download images
-        print("\n📥 Downloading images...")
-        count = 0
-        for i, url in enumerate(image_urls[:20]):
-            try:
-                r = requests.get(url, timeout=60)
-                r.raise_for_status()
-                img = Image.open(BytesIO(r.content)).convert("RGB")
-
-                w, h = img.size
-                s = min(w, h)
-                left, top = (w - s) // 2, (h - s) // 2
-                img = img.crop((left, top, left + s, top + s))
-                img = img.resize((512, 512), Image.Resampling.LANCZOS)
-
-                img.save(img_dir / f"{count:03d}.jpg", quality=95)
-                (img_dir / f"{count:03d}.txt").write_text(f"photo of {trigger} person")
-
-                count += 1
-                print(f"   ✓ {count}")
-            except Exception as e:
-                print(f"   ✗ {e}")
-
-        if count < 5:
-            raise ValueError(f"Need ≥5 images, got {count}")
-
-        print(f"\n📸 {count} images ready")
-
-        # Create config
-        config = {
-            "job": "extension",
-            "config": {
-                "name": f"lora_{character_id[:8]}",
-                "process": [
-                    {
-                        "type": "sd_trainer",
-                        "training_folder": str(out_dir),
-                        "device": "cuda:0",
-                        "trigger_word": trigger,
-                        "network": {
-                            "type": "lora",
-                            "linear": rank,
-                            "linear_alpha": rank,
-                        },
-                        "save": {
-                            "dtype": "float16",
-                            "save_every": steps,
-                            "max_step_saves_to_keep": 1,
-                        },
-                        "datasets": [
-                            {
-                                "folder_path": str(img_dir),
-                                "caption_ext": "txt",
-                                "caption_dropout_rate": 0.05,
-                                "shuffle_tokens": False,
-                                "cache_latents_to_disk": True,
-                                "resolution": [512, 512],
-                            }
-                        ],
-                        "train": {
-                            "batch_size": 1,
-                            "steps": steps,
-                            "gradient_accumulation_steps": 1,
-                            "train_unet": True,
-                            "train_text_encoder": False,
-                            "gradient_checkpointing": True,
-                            "noise_scheduler": "flowmatch",
-                            "optimizer": "adamw8bit",
-                            "lr": lr,
-                            "ema_config": {"use_ema": False},
-                            "dtype": "bf16",
-                        },
-                        "model": {
-                            "name_or_path": "black-forest-labs/FLUX.1-dev",
-                            "is_flux": True,
-                            "quantize": True,
-                        },
-                        "sample": {
-                            "sampler": "flowmatch",
-                            "sample_every": steps + 100,
-                            "width": 512,
-                            "height": 512,
-                            "prompts": [],
-                            "neg": "",
-                            "seed": 42,
-                            "walk_seed": True,
-                            "guidance_scale": 4,
-                            "sample_steps": 20,
-                        },
-                    }
-                ],
-            },
-            "meta": {
-                "name": f"[lora] {character_name}",
-                "version": "1.0",
-            },
-        }
-
-        config_path = work_dir / "config.yaml"
-        with open(config_path, "w") as f:
-            yaml.dump(config, f, default_flow_style=False)
-
-        print("\n🏋️ Starting training...")
-
-        result = subprocess.run(
-            ["python", "/ai-toolkit/run.py", str(config_path)],
-            cwd="/ai-toolkit",
-            capture_output=True,
-            text=True,
-            env={
-                **os.environ,
-                "HF_HOME": "/cache",
-                "TRANSFORMERS_CACHE": "/cache",
-                "TORCH_HOME": "/cache/torch",
-            },
+        result = train_character(
+            character_id, character_name, image_urls, work_dir, steps, lr, rank,
+            search_root="/tmp", early_stop=early_stop, adaptive_steps=adaptive_steps,
         )
 
-        if result.stdout:
-            lines = result.stdout.split('\n')
-            print("STDOUT (last 60 lines):")
-            for line in lines[-60:]:
-                print(line)
-
-        if result.returncode != 0:
-            if result.stderr:
-                print("\nSTDERR:")
-                lines = result.stderr.split('\n')
-                for line in lines[-30:]:
-                    print(line)
-            raise RuntimeError(f"Training failed with code {result.returncode}")
-
-        # Find LoRA
-        lora_files = list(out_dir.rglob("*.safetensors"))
-        if not lora_files:
-            lora_files = list(Path("/tmp").rglob("*.safetensors"))
-
-        if not lora_files:
-            raise RuntimeError("No LoRA file found")
-
-        lora_path = lora_files[0]
-        print(f"\n💾 LoRA: {lora_path} ({lora_path.stat().st_size / 1e6:.1f} MB)")
-
-        # Upload
-        print("\n☁️ Uploading...")
-        with open(lora_path, "rb") as f:
-            data = f.read()
-
-        path = f"{character_id}/lora.safetensors"
-        url = f"{supabase_url}/storage/v1/object/loras/{path}"
-
-        r = requests.post(
-            url,
-            headers={
-                "Authorization": f"Bearer {supabase_key}",
-                "Content-Type": "application/octet-stream",
-                "x-upsert": "true",
-            },
-            data=data,
-            timeout=300,
-        )
-
-        if r.status_code not in (200, 201):
-            requests.post(
-                f"{supabase_url}/storage/v1/bucket",
-                headers={"Authorization": f"Bearer {supabase_key}", "Content-Type": "application/json"},
-                json={"id": "loras", "name": "loras", "public": True},
-            )
-            r = requests.post(url, headers={
-                "Authorization": f"Bearer {supabase_key}",
-                "Content-Type": "application/octet-stream",
-                "x-upsert": "true",
-            }, data=data, timeout=300)
-
-        model_url = f"{supabase_url}/storage/v1/object/public/loras/{path}"
-        print(f"   ✅ {model_url}")
-
-        requests.post(webhook_url, json={
+        notify_webhook(webhook_url, {
             "character_id": character_id,
             "status": "ready",
-            "model_url": model_url,
-            "trigger_word": trigger,
-        }, timeout=30)
+            **result,
+        })
 
         print("\n🎉 Done!")
-        return {"success": True, "model_url": model_url}
+        return {
+            "success": True,
+            "model_url": result["model_url"],
+            "gpu_seconds_saved": result.get("training", {}).get("gpu_seconds_saved", 0),
+        }
 
     except Exception as e:
         print(f"\n❌ Error: {e}")
         import traceback
         traceback.print_exc()
 
-        requests.post(webhook_url, json={
+        notify_webhook(webhook_url, {
             "character_id": character_id,
             "status": "failed",
             "error": str(e),
-        }, timeout=30)
+        })
 
         return {"success": False, "error": str(e)}
 
 
+@app.function(
+    image=training_image,
+    gpu="A100-80GB",
+    timeout=86400,
+    secrets=[
+        modal.Secret.from_name("huggingface-secret"),
+        modal.Secret.from_name("supabase-secret"),
+    ],
+    volumes={"/cache": model_cache},
+    mounts=[local_modules],
+    concurrency_limit=WORKER_LIMIT,
+)
+def train_lora_worker(
+    max_jobs: int = WORKER_MAX_JOBS,
+    idle_timeout: float = WORKER_IDLE_TIMEOUT,
+    lease_id: str | None = None,
+):
+    """
+    Train queued characters back to back on one container, keeping the
+    quantized FLUX base loaded between them
+    """
+    lease_id = lease_id or uuid.uuid4().hex
+    stop_lease = worker_leases.keep_alive(lease_id)
+    try:
+        results = run_worker(max_jobs, idle_timeout)
+    finally:
+        stop_lease()
+        worker_leases.release(lease_id)
+
+    # Hand anything still queued to a fresh worker, unless the others cover it
+    maybe_spawn_worker()
+
+    print(f"\n🎉 Worker done: {sum(r['success'] for r in results)}/{len(results)} succeeded")
+    return results
+
+
+def run_worker(max_jobs: int, idle_timeout: float) -> list:
+    import shutil
+    from pathlib import Path
+
+    from resident_trainer import ResidentBase, UnsupportedToolkit
+    from training_queue import TrainingWorker, queue_puller
+
+    print(f"🚀 LoRA training worker (up to {max_jobs} jobs)")
+    setup_environment()
+
+    base = ResidentBase(pinned_commit=AI_TOOLKIT_COMMIT)
+    try:
+        base.install()
+        run, reset = base.run, base.reset
+    except (ImportError, AttributeError, UnsupportedToolkit) as e:
+        # Still drains the queue, just without the resident base
+        print(f"   ⚠️ In-process ai-toolkit unavailable ({e}); one subprocess per job")
+        base = None
+        run, reset = run_toolkit, lambda: None
+
+    def train(job):
+        work_dir = Path("/tmp/training") / job.character_id
+        reuses = base.reuses if base else 0
+        print(f"   Steps: {job.steps}, LR: {job.lr}, Rank: {job.rank}")
+        try:
+            result = train_character(
+                job.character_id, job.character_name, job.image_urls, work_dir,
+                job.steps, job.lr, job.rank, run=run,
+                early_stop=job.early_stop, adaptive_steps=job.adaptive_steps,
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        result["base_reused"] = bool(base and base.reuses > reuses)
+        return result
+
+    worker = TrainingWorker(
+        pull=queue_puller(training_jobs),
+        train=train,
+        notify=notify_webhook,
+        reset=reset,
+        max_jobs=max_jobs,
+        idle_timeout=idle_timeout,
+    )
+    return worker.run()
+
+
+def maybe_spawn_worker() -> int:
+    """Start a worker if the queue outgrew the live ones; returns the queue length"""
+    pending = training_jobs.len()
+    if should_spawn_worker(pending, worker_leases.active(), WORKER_MAX_JOBS, WORKER_LIMIT):
+        # The lease counts the worker while it is still starting up
+        lease_id = uuid.uuid4().hex
+        worker_leases.renew(lease_id, ttl=WORKER_START_TTL)
+        try:
+            train_lora_worker.spawn(lease_id=lease_id)
+        except Exception:
+            worker_leases.release(lease_id)
+            raise
+    return pending
+
+
 @app.function(
     image=training_image,
     secrets=[modal.Secret.from_name("supabase-secret")],
     timeout=60,
+    mounts=[local_modules],
 )
 @modal.fastapi_endpoint(method="POST", label="carmi-train-lora")
 def start_training(request: dict):
@@ -342,7 +611,7 @@ def start_training(request: dict):
     if not cid or not cname or len(urls) < 5 or not webhook:
         return {"success": False, "error": "Missing required fields"}
 
-    train_lora.spawn(
+    params = dict(
         character_id=cid,
         character_name=cname,
         image_urls=urls,
@@ -350,6 +619,15 @@ def start_training(request: dict):
         steps=request.get("num_train_steps", 500),
         lr=request.get("learning_rate", 1e-4),
         rank=request.get("lora_rank", 16),
+        early_stop=request.get("early_stop", EARLY_STOP),
+        adaptive_steps=request.get("adaptive_steps", ADAPTIVE_STEPS),
     )
 
+    if request.get("training_mode", TRAINING_MODE) == "queue":
+        training_jobs.put(TrainingJob(**params).as_dict())
+        pending = maybe_spawn_worker()
+        return {"success": True, "message": "Training queued", "queued": pending}
+
+    train_lora.spawn(**params)
+
     return {"success": True, "message": "Training started"}
\ No newline at end of file
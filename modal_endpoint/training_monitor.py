@@ -0,0 +1,181 @@
+# modal_endpoint/training_monitor.py
+"""
+Convergence monitor for LoRA training.
+
+Fed (step, loss) pairs as ai-toolkit reports them, it smooths the loss
+with an EMA and calls a plateau once the smoothed loss has not improved
+by `min_delta` (relative) for `patience` steps past `min_steps`. Training
+only stops at a saved checkpoint, so the normal "find the newest
+.safetensors and upload it" path still applies.
+
+Pure Python: replay a recorded curve with
+    python training_monitor.py losses.txt --budget 500
+(one "step loss" pair or one loss per line).
+"""
+
+import math
+import os
+import re
+import time
+from typing import Callable, Optional
+
+STEPS_PER_IMAGE = int(os.environ.get("LORA_STEPS_PER_IMAGE", "40"))
+MIN_BUDGET = int(os.environ.get("LORA_MIN_STEPS", "200"))
+CHECK_EVERY = int(os.environ.get("LORA_CHECKPOINT_EVERY", "50"))
+
+# tqdm postfix written by ai-toolkit: "... 120/500 [01:02<03:18, 1.9it/s, lr: 1.0e-04 loss: 4.1e-01]"
+PROGRESS_RE = re.compile(r"(\d+)/(\d+) \[[^\]]*?\bloss: ([-+0-9.eE]+|nan|inf)")
+CHECKPOINT_RE = re.compile(r"_(\d{9})\.safetensors$")
+
+
+class EarlyStop(Exception):
+    """Raised inside an in-process training loop to end it at a checkpoint"""
+
+
+def step_budget(image_count: int, requested: int) -> int:
+    """Steps scaled to the dataset: STEPS_PER_IMAGE each, never above what was asked for"""
+    return min(requested, max(MIN_BUDGET, STEPS_PER_IMAGE * image_count))
+
+
+def parse_progress(line: str) -> Optional[tuple]:
+    """(step, total, loss) from an ai-toolkit progress line, else None"""
+    match = PROGRESS_RE.search(line)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2)), float(match.group(3))
+
+
+def checkpoint_step(filename: str) -> Optional[int]:
+    """Step of an intermediate save (`<name>_000000150.safetensors`)"""
+    match = CHECKPOINT_RE.search(filename)
+    return int(match.group(1)) if match else None
+
+
+class PlateauMonitor:
+    """
+    `observe(step, loss)` returns True when training should end now: the
+    smoothed loss has plateaued and a checkpoint at or after its best step
+    exists (`checkpoint()` returns the newest saved step, or None).
+    ai-toolkit reports a step's loss just before writing that step's save,
+    so a checkpoint is only trusted once training has moved past it
+    (saved < step); one at the current step may still be half-written.
+    With `stop=False` it only tracks progress for the report.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        requested: Optional[int] = None,
+        checkpoint: Callable[[], Optional[int]] = lambda: None,
+        stop: bool = True,
+        patience: int = 100,
+        min_steps: Optional[int] = None,
+        smoothing: float = 0.95,
+        min_delta: float = 0.01,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.budget = budget
+        self.requested = requested or budget
+        self.checkpoint = checkpoint
+        self.stop = stop
+        self.patience = patience
+        self.min_steps = min_steps if min_steps is not None else max(100, int(budget * 0.3))
+        self.smoothing = smoothing
+        self.min_delta = min_delta
+        self.clock = clock
+
+        self.ema: Optional[float] = None
+        self.best: Optional[float] = None
+        self.best_step = 0
+        self.last_step = 0
+        self.plateau_step: Optional[int] = None
+        self.stopped_at: Optional[int] = None
+        self.first_seen: Optional[tuple] = None
+        self.last_seen: Optional[tuple] = None
+
+    def observe(self, step: int, loss: float) -> bool:
+        self.last_step = max(self.last_step, step)
+        self.last_seen = (step, self.clock())
+        if self.first_seen is None:
+            self.first_seen = self.last_seen
+        if not math.isfinite(loss):
+            return False
+
+        if self.ema is None:
+            self.ema = loss
+        else:
+            self.ema = self.smoothing * self.ema + (1 - self.smoothing) * loss
+
+        if self.best is None or self.ema < self.best * (1 - self.min_delta):
+            self.best = self.ema
+            self.best_step = step
+            self.plateau_step = None
+        elif (
+            self.plateau_step is None
+            and step >= self.min_steps
+            and step - self.best_step >= self.patience
+        ):
+            self.plateau_step = step
+
+        if not self.stop or self.plateau_step is None:
+            return False
+        saved = self.checkpoint()
+        if saved is not None and self.best_step <= saved < step:
+            self.stopped_at = saved
+            return True
+        return False
+
+    @property
+    def stopped_early(self) -> bool:
+        return self.stopped_at is not None
+
+    def seconds_per_step(self, train_seconds: float) -> float:
+        """From the observed steps when possible, so model loading isn't counted"""
+        if self.first_seen and self.last_seen and self.last_seen[0] > self.first_seen[0]:
+            return (self.last_seen[1] - self.first_seen[1]) / (self.last_seen[0] - self.first_seen[0])
+        steps_run = self.last_step or self.budget
+        return train_seconds / steps_run if steps_run else 0.0
+
+    def summary(self, train_seconds: float) -> dict:
+        """Steps actually run and the GPU time the budget + early stop saved"""
+        steps_run = self.last_step or self.budget
+        per_step = self.seconds_per_step(train_seconds)
+        saved_steps = self.requested - steps_run
+        return {
+            "steps_requested": self.requested,
+            "steps_budget": self.budget,
+            "steps_run": steps_run,
+            "stopped_early": self.stopped_early,
+            "checkpoint_step": self.stopped_at,
+            "smoothed_loss": round(self.ema, 5) if self.ema is not None else None,
+            "gpu_seconds_saved": round(max(0, saved_steps) * per_step, 1),
+        }
+
+
+def _replay(path: str, budget: int, every: int) -> dict:
+    """Run a recorded curve through the monitor with a save every `every` steps"""
+    # One unit of "time" per step, so gpu_seconds_saved reads as steps saved
+    monitor = PlateauMonitor(budget, clock=lambda: float(monitor.last_step))
+    monitor.checkpoint = lambda: (monitor.last_step // every) * every or None
+
+    with open(path) as f:
+        for i, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts:
+                continue
+            step, loss = (int(parts[0]), float(parts[1])) if len(parts) > 1 else (i, float(parts[0]))
+            if step > budget or monitor.observe(step, loss):
+                break
+    return monitor.summary(train_seconds=monitor.last_step)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Replay a recorded loss curve")
+    parser.add_argument("curve")
+    parser.add_argument("--budget", type=int, default=500)
+    parser.add_argument("--every", type=int, default=CHECK_EVERY, help="Checkpoint interval")
+    args = parser.parse_args()
+    print(json.dumps(_replay(args.curve, args.budget, args.every), indent=2))
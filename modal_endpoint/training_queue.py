@@ -0,0 +1,199 @@
+# modal_endpoint/training_queue.py
+"""
+Queue-driven LoRA training worker.
+
+One GPU container pulls queued characters and trains them back to back,
+so FLUX.1-dev is loaded and quantized once per container instead of once
+per character. The worker only sees three callables (pull a job, train
+it, report it), so the queueing logic runs with a stub trainer and a
+plain queue.Queue.
+"""
+
+import queue
+import threading
+import time
+import traceback
+from dataclasses import asdict, dataclass, field, fields
+from typing import Callable, Optional
+
+
+@dataclass
+class TrainingJob:
+    """One character to train, as queued by the endpoint"""
+
+    character_id: str
+    character_name: str
+    image_urls: list
+    webhook_url: str
+    steps: int = 500
+    lr: float = 1e-4
+    rank: int = 16
+    early_stop: bool = False
+    adaptive_steps: bool = False
+    enqueued_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TrainingJob":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def queue_puller(q) -> Callable[[float], Optional[dict]]:
+    """Adapt a modal.Queue (or queue.Queue) to the worker's pull(timeout)"""
+
+    def pull(timeout: float) -> Optional[dict]:
+        try:
+            return q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    return pull
+
+
+def should_spawn_worker(
+    pending: int, active: int, jobs_per_worker: int, limit: Optional[int] = None
+) -> bool:
+    """
+    Called with the queue length and the number of live workers (started
+    or starting): spawn only when the backlog is more than the active
+    workers will take (`jobs_per_worker` each) and `limit` isn't reached
+    """
+    if limit is not None and active >= limit:
+        return False
+    return pending > active * max(1, jobs_per_worker)
+
+
+class WorkerLeases:
+    """
+    Live training workers as leases in a shared mapping (a modal.Dict):
+    worker id -> expiry time. Workers renew theirs while running and drop
+    it on exit; a crashed container's lease just runs out, so the count
+    can't drift the way a plain counter would.
+    """
+
+    def __init__(self, mapping, ttl: float = 180.0, clock: Callable[[], float] = time.time):
+        self.mapping = mapping
+        self.ttl = ttl
+        self.clock = clock
+
+    def renew(self, worker_id: str, ttl: Optional[float] = None) -> None:
+        self.mapping[worker_id] = self.clock() + (ttl if ttl is not None else self.ttl)
+
+    def release(self, worker_id: str) -> None:
+        try:
+            del self.mapping[worker_id]
+        except KeyError:
+            pass
+
+    def active(self) -> int:
+        now = self.clock()
+        count = 0
+        for worker_id, expires_at in list(self.mapping.items()):
+            if expires_at > now:
+                count += 1
+            else:
+                self.release(worker_id)
+        return count
+
+    def keep_alive(self, worker_id: str) -> Callable[[], None]:
+        """Renew `worker_id` every ttl/3 on a daemon thread; returns a stop function"""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.ttl / 3):
+                try:
+                    self.renew(worker_id)
+                except Exception as e:
+                    print(f"⚠️ Worker lease renewal failed: {e}")
+
+        self.renew(worker_id)
+        threading.Thread(target=beat, daemon=True).start()
+        return stop.set
+
+
+class TrainingWorker:
+    """
+    Trains queued jobs one after another until the queue stays empty for
+    `idle_timeout` seconds or `max_jobs` have run.
+
+    `train(job)` returns the webhook fields for a finished LoRA (model_url,
+    trigger_word, ...); `reset()` returns the resident model to its base
+    state and runs after every job, successful or not. If reset fails the
+    worker stops, because the next job would start from a dirty base.
+    """
+
+    def __init__(
+        self,
+        pull: Callable[[float], Optional[dict]],
+        train: Callable[[TrainingJob], dict],
+        notify: Callable[[str, dict], None],
+        reset: Callable[[], None] = lambda: None,
+        max_jobs: int = 8,
+        idle_timeout: float = 60.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.pull = pull
+        self.train = train
+        self.notify = notify
+        self.reset = reset
+        self.max_jobs = max(1, max_jobs)
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.results: list = []
+        self.healthy = True
+
+    def run(self) -> list:
+        while self.healthy and len(self.results) < self.max_jobs:
+            item = self.pull(self.idle_timeout)
+            if item is None:
+                break
+            try:
+                job = TrainingJob.from_dict(item)
+            except TypeError as e:
+                print(f"⚠️ Skipping malformed job {item!r}: {e}")
+                continue
+            self.results.append(self.run_job(job))
+        return self.results
+
+    def run_job(self, job: TrainingJob) -> dict:
+        index = len(self.results) + 1
+        started = self.clock()
+        print(f"\n🧵 Job {index}: {job.character_name} ({job.character_id})")
+
+        try:
+            payload = {
+                "character_id": job.character_id,
+                "status": "ready",
+                **self.train(job),
+            }
+        except Exception as e:
+            traceback.print_exc()
+            payload = {
+                "character_id": job.character_id,
+                "status": "failed",
+                "error": str(e),
+            }
+
+        try:
+            self.reset()
+        except Exception:
+            traceback.print_exc()
+            self.healthy = False
+
+        finished = self.clock()
+        payload["queue_seconds"] = round(max(0.0, started - job.enqueued_at), 1)
+        payload["train_seconds"] = round(finished - started, 1)
+        payload["worker_job"] = index
+
+        try:
+            self.notify(job.webhook_url, payload)
+        except Exception as e:
+            print(f"⚠️ Webhook failed for {job.character_id}: {e}")
+
+        return {
+            "success": payload["status"] == "ready",
+            **payload,
+        }
@@ -0,0 +1,238 @@
+"""
+On-disk mask track shared by extract and merge
+Stores one selfie segmentation mask per frame so a second pass over the
+same video (extract first, merge later) skips MediaPipe entirely.
+
+Masks are quantized to uint8 at the segmentation model's resolution
+(long side 256) and zlib-compressed per frame; deflate collapses the long
+0/255 runs of a person mask to a few hundred bytes. The file is read
+through mmap and a fixed-size frame index, so any frame can be loaded
+by number without touching the others.
+
+Layout:
+    b"MASKTRK1" | u32 meta length | meta JSON
+    compressed frame chunks ...
+    index: frame_count x (u64 offset, u32 length)   (length 0 = no mask)
+    footer: u64 index offset | u32 frame count | b"MTRKEND\\0"
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import uuid
+import zlib
+from contextlib import nullcontext
+from typing import Callable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from video_window import Roi, crop
+
+MAGIC = b"MASKTRK1"
+END_MAGIC = b"MTRKEND\0"
+FOOTER = struct.Struct("<QI8s")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4")])
+TRACK_LONG_SIDE = 256
+TRACK_EXT = ".mtrk"
+
+
+def video_key(video_path: str, model_selection: int = 1) -> str:
+    """Content hash of the video plus the segmentation settings"""
+    digest = hashlib.sha256(f"selfie-seg:{model_selection}:".encode())
+    with open(video_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def track_size(width: int, height: int) -> Tuple[int, int]:
+    scale = TRACK_LONG_SIDE / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class MaskTrackWriter:
+    """Appends frames in order; the file only appears once finish() is called"""
+
+    def __init__(self, path: str, width: int, height: int, meta: Optional[dict] = None):
+        self.path = path
+        self.tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        self.size = track_size(width, height)
+        self.index = []
+
+        header = json.dumps({
+            "width": width,
+            "height": height,
+            "track_width": self.size[0],
+            "track_height": self.size[1],
+            **(meta or {}),
+        }).encode()
+
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+    def add(self, frame_idx: int, mask: Optional[np.ndarray]) -> None:
+        # Frames the decoder skipped get an empty entry
+        while len(self.index) < frame_idx:
+            self.index.append((0, 0))
+
+        if mask is None:
+            self.index.append((0, 0))
+            return
+
+        small = cv2.resize(mask, self.size, interpolation=cv2.INTER_AREA)
+        quantized = np.clip(small * 255.0 + 0.5, 0, 255).astype(np.uint8)
+        chunk = zlib.compress(quantized.tobytes(), 1)
+        self.index.append((self.file.tell(), len(chunk)))
+        self.file.write(chunk)
+
+    def finish(self) -> None:
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+        self.file.write(FOOTER.pack(index_offset, len(self.index), END_MAGIC))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        self.file.close()
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class MaskTrackReader:
+    """Random access by frame number over an mmap'd track"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a mask track: {path}")
+        index_offset, frame_count, end = FOOTER.unpack_from(self.mm, len(self.mm) - FOOTER.size)
+        if end != END_MAGIC:
+            self.close()
+            raise ValueError(f"Truncated mask track: {path}")
+
+        (meta_len,) = struct.unpack_from("<I", self.mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.meta = json.loads(self.mm[start:start + meta_len])
+        self.size = (self.meta["track_width"], self.meta["track_height"])
+        self.index = np.frombuffer(self.mm, dtype=INDEX_DTYPE, count=frame_count, offset=index_offset)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get(self, frame_idx: int, size: Optional[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+        """float32 mask in [0, 1] like MediaPipe's, upscaled to `size` (w, h)"""
+        if frame_idx >= len(self.index):
+            return None
+        offset, length = self.index[frame_idx]
+        if length == 0:
+            return None
+
+        offset, length = int(offset), int(length)
+        raw = zlib.decompress(self.mm[offset:offset + length])
+        mask = np.frombuffer(raw, dtype=np.uint8).reshape(self.size[1], self.size[0])
+        mask = mask.astype(np.float32) * (1.0 / 255.0)
+        if size and size != self.size:
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_LINEAR)
+        return mask
+
+    def close(self) -> None:
+        # The index is a view into the mmap; drop it before unmapping
+        self.index = None
+        self.mm.close()
+        self.file.close()
+
+
+class SegmentationSource:
+    """
+    Per-frame masks for one video: loaded from a stored track when one
+    exists, otherwise computed with MediaPipe (and recorded when a track
+    directory is configured and the pass covers every full frame)
+    With an ROI, masks cover only the ROI crop.
+    """
+
+    def __init__(
+        self,
+        segment,
+        video_path: str,
+        width: int,
+        height: int,
+        track_dir: Optional[str] = None,
+        timer: Optional[Callable[[str], object]] = None,
+        roi: Optional[Roi] = None,
+        record: bool = True,
+    ):
+        self.segment = segment
+        self.size = (width, height)
+        self.timer = timer or (lambda stage: nullcontext())
+        self.roi = roi
+        self.reader = None
+        self.writer = None
+
+        if not track_dir:
+            return
+
+        os.makedirs(track_dir, exist_ok=True)
+        with self.timer("video_hash"):
+            path = os.path.join(track_dir, video_key(video_path) + TRACK_EXT)
+
+        if os.path.exists(path):
+            try:
+                self.reader = MaskTrackReader(path)
+                return
+            except (OSError, ValueError):
+                os.unlink(path)
+
+        # A track is always full-frame and full-length; cropped/trimmed passes only read
+        if record and roi is None:
+            self.writer = MaskTrackWriter(path, width, height, meta={"model_selection": 1})
+
+    @property
+    def from_track(self) -> bool:
+        return self.reader is not None
+
+    def mask(self, frame_idx: int, frame: np.ndarray, full_size: bool = True) -> Optional[np.ndarray]:
+        """
+        Mask for `frame` (frame number `frame_idx`); with full_size=False a
+        stored mask is returned at track resolution, which is enough for
+        area/mean scores
+        """
+        if self.reader:
+            with self.timer("mask_load"):
+                mask = self.reader.get(frame_idx)
+                if mask is None:
+                    return None
+                # Crop at track resolution, then upscale only the ROI
+                mask = crop(mask, self.roi, self.size)
+                if full_size:
+                    target = self.roi[2:] if self.roi else self.size
+                    mask = cv2.resize(mask, target, interpolation=cv2.INTER_LINEAR)
+                return mask
+
+        with self.timer("cvtColor"):
+            rgb_frame = cv2.cvtColor(crop(frame, self.roi), cv2.COLOR_BGR2RGB)
+        with self.timer("segmentation"):
+            results = self.segment.process(rgb_frame)
+        mask = results.segmentation_mask
+
+        if self.writer:
+            with self.timer("mask_store"):
+                self.writer.add(frame_idx, mask)
+        return mask
+
+    def close(self, complete: bool = True) -> None:
+        """Keep the recorded track only if every frame went through it"""
+        if self.writer:
+            if complete:
+                self.writer.finish()
+            else:
+                self.writer.abort()
+        if self.reader:
+            self.reader.close()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark for the video processing scripts
+Generates synthetic clips locally and times extract / merge / the Flask
+/process-video path. No network or GPU needed; results are JSON so runs
+can be compared across commits.
+"""
+
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+CLI = os.path.join(SCRIPTS_DIR, "video-processor.py")
+SERVICE = os.path.join(SCRIPTS_DIR, "video-processor-service.py")
+
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+LENGTHS = {"short": 2.0, "long": 10.0}
+FPS = 30
+
+
+def synth_background(width: int, height: int, seed: int) -> np.ndarray:
+    """Smooth colour gradient with some texture, so sharpness isn't zero"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    base = np.stack([
+        np.broadcast_to(x * 200 + 30, (height, width)),
+        np.broadcast_to(y * 160 + 60, (height, width)),
+        (x * y) * 180 + 40,
+    ], axis=-1)
+    noise = rng.integers(0, 25, (height, width, 3), dtype=np.uint8)
+    return np.clip(base, 0, 230).astype(np.uint8) + noise
+
+
+def draw_person(frame: np.ndarray, t: float) -> None:
+    """
+    Head-and-shoulders figure that sways across the frame, big enough and
+    with a face, so selfie segmentation clears the extract threshold
+    (mean mask > 0.3) on nearly every frame
+    """
+    height, width = frame.shape[:2]
+    cx = int(width * (0.5 + 0.08 * np.sin(t * 1.5)))
+    head_r = height // 4
+    head_y = int(height * 0.38)
+    body_y = head_y + int(head_r * 1.9)
+    shoulder = int(head_r * 2.6)
+    skin = (140, 170, 220)
+    shirt = (90, 60, 40)
+
+    cv2.ellipse(frame, (cx, body_y), (shoulder, int(head_r * 0.9)),
+                0, 180, 360, shirt, -1, cv2.LINE_AA)
+    cv2.rectangle(frame, (cx - shoulder, body_y), (cx + shoulder, height), shirt, -1)
+    cv2.rectangle(frame, (cx - head_r // 2, head_y + head_r // 2),
+                  (cx + head_r // 2, body_y), skin, -1)
+    cv2.ellipse(frame, (cx, head_y), (int(head_r * 0.8), head_r),
+                0, 0, 360, skin, -1, cv2.LINE_AA)
+    cv2.ellipse(frame, (cx, head_y - head_r // 2), (int(head_r * 0.85), head_r // 2),
+                0, 180, 360, (30, 30, 40), -1, cv2.LINE_AA)
+
+    # Eyes and mouth: without them the segmenter barely fires
+    eye = max(2, head_r // 10)
+    for side in (-1, 1):
+        cv2.circle(frame, (cx + side * head_r // 3, head_y), eye, (40, 30, 30), -1, cv2.LINE_AA)
+    cv2.ellipse(frame, (cx, head_y + head_r // 2), (head_r // 4, head_r // 10),
+                0, 0, 180, (60, 60, 150), -1, cv2.LINE_AA)
+
+
+def make_clip(path: str, size: Tuple, seconds: float, person: bool) -> int:
+    width, height = size
+    background = synth_background(width, height, seed=width)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), FPS, (width, height))
+    frames = int(seconds * FPS)
+
+    for i in range(frames):
+        frame = np.roll(background, i * 4, axis=1)
+        if person:
+            draw_person(frame, i / FPS)
+        out.write(frame)
+
+    out.release()
+    return frames
+
+
+def make_background(path: str) -> None:
+    cv2.imwrite(path, synth_background(1920, 1080, seed=7)[:, ::-1])
+
+
+def measure_decode(path: str) -> float:
+    """Decode-only pass: the floor every command pays"""
+    cap = cv2.VideoCapture(path)
+    started = time.perf_counter()
+    while cap.grab():
+        cap.retrieve()
+    cap.release()
+    return time.perf_counter() - started
+
+
+def run_measured(cmd: List[str]) -> dict:
+    """Run one child process; wall time and its own peak RSS (wait4 rusage)"""
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        started = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=out, stderr=err)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+        out.seek(0)
+        err.seek(0)
+        stdout, stderr = out.read().decode(), err.read().decode()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed:\n{stderr[-2000:]}")
+
+    # ru_maxrss is KiB on Linux
+    return {"seconds": elapsed, "peak_rss_mb": round(usage.ru_maxrss / 1024, 1), "stdout": stdout}
+
+
+def flask_child(action: str, video_path: str, background_path: str, image_count: str) -> None:
+    """Runs inside a child process: one /process-video request via the test client"""
+    spec = importlib.util.spec_from_file_location("video_processor_service", SERVICE)
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+
+    with open(video_path, "rb") as f:
+        payload = {"action": action, "video_base64": base64.b64encode(f.read()).decode()}
+    if action == "merge_video":
+        with open(background_path, "rb") as f:
+            payload["background_base64"] = base64.b64encode(f.read()).decode()
+    else:
+        payload["image_count"] = int(image_count)
+
+    response = service.app.test_client().post("/process-video", json=payload)
+    if response.status_code != 200:
+        sys.stderr.write(response.get_data(as_text=True))
+        sys.exit(1)
+
+    body = response.get_data()
+    frames = len(response.get_json().get("frames", [])) if action == "extract_frames" else None
+    stages = {
+        name.split(":", 1)[-1]: stage["total"]
+        for name, stage in service.metrics.report()["stages"].items()
+    }
+    print(json.dumps({"response_bytes": len(body), "frames": frames, "stages": stages}))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_clip(
+    clip: dict, background_path: str, work_dir: str, paths: List[str], image_count: int
+) -> List[dict]:
+    """
+    Run every selected path against one clip; extracting nothing from a
+    clip with a person fails the run, since it would only time the scoring
+    """
+    results = []
+    py = sys.executable
+
+    for path in paths:
+        out_dir = os.path.join(work_dir, f"{clip['name']}-{path}")
+        os.makedirs(out_dir, exist_ok=True)
+        profile_path = os.path.join(work_dir, f"{clip['name']}-{path}.profile.json")
+
+        if path == "extract":
+            cmd = [py, CLI, "--profile", profile_path, "extract", clip["path"],
+                   str(image_count), out_dir]
+        elif path == "merge":
+            cmd = [py, CLI, "--profile", profile_path, "merge", clip["path"], background_path,
+                   os.path.join(out_dir, "merged.mp4")]
+        else:
+            action = "extract_frames" if path == "service-extract" else "merge_video"
+            cmd = [py, os.path.abspath(__file__), "--flask-child", action, clip["path"],
+                   background_path, str(image_count)]
+
+        run = run_measured(cmd)
+
+        extracted = None
+        if path == "extract":
+            extracted = len(json.loads(run["stdout"].strip().splitlines()[-1]))
+        if path in ("extract", "merge"):
+            output_bytes = sum(
+                os.path.getsize(os.path.join(out_dir, f)) for f in os.listdir(out_dir)
+            )
+            with open(profile_path) as f:
+                profile = json.load(f)["stages"]
+            stages = {name: stage["total"] for name, stage in profile.items()}
+        else:
+            child = json.loads(run["stdout"].strip().splitlines()[-1])
+            output_bytes = child["response_bytes"]
+            stages = child["stages"]
+            extracted = child["frames"]
+
+        if clip["person"] and extracted == 0:
+            raise RuntimeError(f"{clip['name']} {path}: no frames extracted from a clip with a person")
+
+        # decode_only is a bare decode pass over the clip, for reference
+        stages.update({"decode_only": clip["decode_seconds"], "total": run["seconds"]})
+        results.append({
+            "clip": clip["name"],
+            "path": path,
+            "frames": clip["frames"],
+            "extracted": extracted,
+            "seconds": round(run["seconds"], 3),
+            "fps": round(clip["frames"] / run["seconds"], 2),
+            "peak_rss_mb": run["peak_rss_mb"],
+            "output_bytes": output_bytes,
+            "stages": {k: round(v, 3) for k, v in stages.items()},
+        })
+        print(
+            f"{clip['name']:<22} {path:<16} {results[-1]['fps']:>7.1f} fps "
+            f"{run['peak_rss_mb']:>7.0f} MB  {output_bytes / 1e6:>7.1f} MB out",
+            file=sys.stderr,
+        )
+
+    return results
+
+
+def compare(results: List[dict], baseline: dict) -> List[str]:
+    before = {(r["clip"], r["path"]): r for r in baseline.get("results", [])}
+    lines = []
+    for r in results:
+        old = before.get((r["clip"], r["path"]))
+        if old:
+            change = (r["fps"] - old["fps"]) / old["fps"] * 100 if old["fps"] else 0.0
+            lines.append(
+                f"{r['clip']:<22} {r['path']:<16} {old['fps']:>7.1f} -> {r['fps']:>7.1f} fps "
+                f"({change:+.1f}%), rss {old['peak_rss_mb']} -> {r['peak_rss_mb']} MB"
+            )
+    return lines
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--flask-child":
+        flask_child(*sys.argv[2:6])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the video processing scripts")
+    parser.add_argument("--resolutions", default="720p,1080p,4k",
+                        help=f"Comma-separated subset of {','.join(RESOLUTIONS)}")
+    parser.add_argument("--lengths", default="short,long",
+                        help=f"Comma-separated subset of {','.join(LENGTHS)}")
+    parser.add_argument("--paths", default="extract,merge,service-extract,service-merge",
+                        help="Which entry points to run")
+    parser.add_argument("--image-count", type=int, default=20,
+                        help="Frames to extract per clip (default: 20)")
+    parser.add_argument("--no-person", action="store_true", help="Skip clips with a foreground")
+    parser.add_argument("--person-only", action="store_true", help="Skip clips without a foreground")
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Print fps/RSS changes against an earlier report")
+    parser.add_argument("--keep", help="Keep generated clips and outputs in this directory")
+    args = parser.parse_args()
+
+    persons = [True, False]
+    if args.no_person:
+        persons = [False]
+    if args.person_only:
+        persons = [True]
+
+    work_dir = args.keep or tempfile.mkdtemp(prefix="video-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    background_path = os.path.join(work_dir, "background.jpg")
+    make_background(background_path)
+
+    results = []
+    try:
+        for res in args.resolutions.split(","):
+            for length in args.lengths.split(","):
+                for person in persons:
+                    name = f"{res}-{length}-{'person' if person else 'empty'}"
+                    clip_path = os.path.join(work_dir, f"{name}.mp4")
+                    frames = make_clip(clip_path, RESOLUTIONS[res], LENGTHS[length], person)
+                    clip = {
+                        "name": name,
+                        "path": clip_path,
+                        "frames": frames,
+                        "person": person,
+                        "decode_seconds": measure_decode(clip_path),
+                    }
+                    results.extend(bench_clip(
+                        clip, background_path, work_dir, args.paths.split(","), args.image_count
+                    ))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(results, json.load(f))), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ Flask API service for video processing with MediaPipe
 Run this on a server with Python and MediaPipe installed
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import cv2
 import mediapipe as mp
@@ -13,53 +13,113 @@ import base64
 import tempfile
 import os
 import json
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from frame_encoding import (
+    MULTIPART_MIMETYPE,
+    EncodedFrame,
+    EncodeOptions,
+    ImageFormat,
+    encode_frames,
+    encode_options,
+    multipart_boundary,
+    multipart_stream,
+)
+from mask_track import SegmentationSource
+from video_metrics import Metrics
+from video_window import Roi, crop, frame_range, parse_roi, parse_seconds
 
 app = Flask(__name__)
 CORS(app)
 
+# VIDEO_METRICS=0 turns every timer into a no-op
+metrics = Metrics(enabled=os.environ.get("VIDEO_METRICS", "1") != "0")
+
 mp_selfie = mp.solutions.selfie_segmentation
 segment = mp_selfie.SelfieSegmentation(model_selection=1)
 
+# Uploads already segmented once (e.g. extract, then merge) reuse their masks
+MASK_TRACK_DIR = os.environ.get("MASK_TRACK_DIR")
+
+ACTIONS = ("extract_frames", "merge_video")
+
 
 def calculate_sharpness(image: np.ndarray) -> float:
     """Calculate image sharpness using Laplacian variance"""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    with metrics.timer("sharpness", "extract_frames"):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
     return laplacian_var
 
 
-def has_selfie_segmentation(frame: np.ndarray) -> Tuple[bool, float]:
-    """Check if frame has selfie segmentation and return quality score"""
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = segment.process(rgb_frame)
-    
-    if results.segmentation_mask is None:
+def score_selfie_mask(segmentation_mask: Optional[np.ndarray]) -> Tuple[bool, float]:
+    """Selfie check on a segmentation mask (at any resolution)"""
+    if segmentation_mask is None:
         return False, 0.0
     
-    mask = results.segmentation_mask > 0.5
-    segmentation_quality = float(np.mean(results.segmentation_mask))
+    mask = segmentation_mask > 0.5
+    segmentation_quality = float(np.mean(segmentation_mask))
     
-    selfie_area = np.sum(mask) / (frame.shape[0] * frame.shape[1])
+    selfie_area = np.count_nonzero(mask) / mask.size
     has_selfie = selfie_area > 0.1 and segmentation_quality > 0.3
     
     return has_selfie, segmentation_quality
 
 
+def mask_source(
+    video_path: str,
+    width: int,
+    height: int,
+    action: str,
+    roi: Optional[Roi] = None,
+    record: bool = True,
+) -> SegmentationSource:
+    """Stored mask track for this upload if MASK_TRACK_DIR has one, else live MediaPipe"""
+    return SegmentationSource(
+        segment, video_path, width, height, MASK_TRACK_DIR,
+        timer=lambda stage: metrics.timer(stage, action),
+        roi=roi, record=record,
+    )
+
+
+def wants_multipart(data: dict) -> bool:
+    """Binary frame parts on request; JSON with base64 stays the default"""
+    if data.get("response_format"):
+        return data["response_format"] == "multipart"
+    return request.accept_mimetypes.best == MULTIPART_MIMETYPE
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/process-video", methods=["POST"])
 def process_video():
+    # Metric label: only known actions, so clients can't mint new series
+    label = "invalid"
     try:
         data = request.json
         action = data.get("action")
+        if action in ACTIONS:
+            label = action
         video_base64 = data.get("video_base64")
         background_base64 = data.get("background_base64")
         image_count = data.get("image_count", 10)
+        # Optional time window (seconds) and region of interest [x, y, w, h]
+        window = {
+            "start": parse_seconds(data.get("start"), "start"),
+            "end": parse_seconds(data.get("end"), "end"),
+            "roi": data.get("roi"),
+        }
         
         if not video_base64:
             return jsonify({"error": "No video provided"}), 400
         
         # Decode video
-        video_data = base64.b64decode(video_base64)
+        with metrics.timer("base64_decode", label):
+            video_data = base64.b64decode(video_base64)
         
         with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as video_file:
             video_file.write(video_data)
@@ -67,72 +127,125 @@ def process_video():
         
         try:
             if action == "extract_frames":
-                return extract_frames(video_path, image_count)
+                encoding = encode_options(
+                    data.get("image_format"), data.get("image_quality"), data.get("thumbnail_size"),
+                )
+                with metrics.timer("request", action):
+                    return extract_frames(
+                        video_path, image_count, encoding=encoding,
+                        multipart=wants_multipart(data), **window,
+                    )
             elif action == "merge_video":
-                if not background_base64:
+                # A single string or a list; several backgrounds share one segmentation pass
+                backgrounds = background_base64 or data.get("backgrounds_base64")
+                if isinstance(backgrounds, str):
+                    backgrounds = [backgrounds]
+                if not backgrounds:
                     return jsonify({"error": "No background image provided"}), 400
-                bg_data = base64.b64decode(background_base64)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as bg_file:
-                    bg_file.write(bg_data)
-                    bg_path = bg_file.name
+                bg_paths = []
                 try:
-                    return merge_video(video_path, bg_path)
+                    for bg_base64 in backgrounds:
+                        bg_data = base64.b64decode(bg_base64)
+                        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as bg_file:
+                            bg_file.write(bg_data)
+                            bg_paths.append(bg_file.name)
+                    with metrics.timer("request", action):
+                        return merge_video(video_path, bg_paths, **window)
                 finally:
-                    os.unlink(bg_path)
+                    for bg_path in bg_paths:
+                        os.unlink(bg_path)
             else:
+                metrics.count("errors", action=label)
                 return jsonify({"error": "Invalid action"}), 400
         finally:
             os.unlink(video_path)
             
+    except ValueError as e:
+        metrics.count("errors", action=label)
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
+        metrics.count("errors", action=label)
         return jsonify({"error": str(e)}), 500
 
 
-def extract_frames(video_path: str, count: int):
-    """Extract best frames with selfie segmentation"""
+def extract_frames(
+    video_path: str,
+    count: int,
+    start=None,
+    end=None,
+    roi=None,
+    encoding: Optional[EncodeOptions] = None,
+    multipart: bool = False,
+):
+    """Extract best frames with selfie segmentation, optionally within a window / ROI"""
+    encoding = encoding or encode_options()
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     
-    candidates = []
-    frame_idx = 0
+    roi = parse_roi(roi, width, height)
+    first, stop = frame_range(cap, start, end)
+    masks = mask_source(video_path, width, height, "extract_frames", roi, record=first == 0 and end is None)
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        timestamp = frame_idx / fps if fps > 0 else frame_idx * 0.033
-        sharpness = calculate_sharpness(frame)
-        has_selfie, seg_quality = has_selfie_segmentation(frame)
-        
-        if has_selfie:
-            score = sharpness * 0.6 + seg_quality * 1000 * 0.4
-            candidates.append({
-                "frame_idx": frame_idx,
-                "timestamp": timestamp,
-                "score": score,
-                "frame": frame,
-            })
-        
-        frame_idx += 1
+    candidates = []
+    frame_idx = first
+    complete = False
     
-    cap.release()
+    try:
+        while cap.isOpened() and frame_idx < stop:
+            with metrics.timer("decode", "extract_frames"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            
+            timestamp = frame_idx / fps if fps > 0 else frame_idx * 0.033
+            sharpness = calculate_sharpness(crop(frame, roi))
+            has_selfie, seg_quality = score_selfie_mask(masks.mask(frame_idx, frame, full_size=False))
+            
+            if has_selfie:
+                score = sharpness * 0.6 + seg_quality * 1000 * 0.4
+                candidates.append({
+                    "frame_idx": frame_idx,
+                    "timestamp": timestamp,
+                    "score": score,
+                    "frame": frame,
+                })
+            
+            frame_idx += 1
+            metrics.count("frames", action="extract_frames")
+        complete = True
+    finally:
+        masks.close(complete)
+        cap.release()
     
     # Sort and take top N
     candidates.sort(key=lambda x: x["score"], reverse=True)
     best_frames = candidates[:count]
     
-    # Encode frames to base64
+    # Encode in parallel; cv2.imencode releases the GIL
+    encoded = encode_frames(
+        [c["frame"] for c in best_frames], encoding,
+        timer=lambda stage: metrics.timer(stage, "extract_frames"),
+    )
+    image_format = encoding.image_format
+    
+    if multipart:
+        return frames_multipart(best_frames, encoded, image_format)
+    
     frames_data = []
-    for i, candidate in enumerate(best_frames):
-        _, buffer = cv2.imencode(".jpg", candidate["frame"])
-        frame_base64 = base64.b64encode(buffer).decode("utf-8")
-        frames_data.append({
-            "index": i + 1,
-            "timestamp": candidate["timestamp"],
-            "score": candidate["score"],
-            "data": frame_base64,
-        })
+    for i, (candidate, frame) in enumerate(zip(best_frames, encoded)):
+        with metrics.timer("base64", "extract_frames"):
+            frame_data = {
+                "index": i + 1,
+                "timestamp": candidate["timestamp"],
+                "score": candidate["score"],
+                "content_type": image_format.content_type,
+                "data": base64.b64encode(frame.image).decode("utf-8"),
+            }
+            if frame.thumbnail is not None:
+                frame_data["thumbnail"] = base64.b64encode(frame.thumbnail).decode("utf-8")
+        frames_data.append(frame_data)
     
     return jsonify({
         "frames": frames_data,
@@ -140,59 +253,144 @@ def extract_frames(video_path: str, count: int):
     })
 
 
-def merge_video(video_path: str, background_path: str):
-    """Merge video with background image"""
+def frames_multipart(
+    best_frames: List[dict],
+    encoded: List[EncodedFrame],
+    image_format: ImageFormat,
+) -> Response:
+    """
+    multipart/form-data: a "metadata" JSON field with the frame list, then
+    frame_1, frame_1_thumb, ... as binary parts streamed from the encoder buffers
+    """
+    frames_meta = []
+    parts = []
+    for i, (candidate, frame) in enumerate(zip(best_frames, encoded)):
+        name = f"frame_{i + 1}"
+        entry = {
+            "index": i + 1,
+            "timestamp": candidate["timestamp"],
+            "score": candidate["score"],
+            "content_type": image_format.content_type,
+            "part": name,
+        }
+        parts.append((name, name + image_format.extension, image_format.content_type, frame.image))
+        if frame.thumbnail is not None:
+            entry["thumbnail_part"] = f"{name}_thumb"
+            parts.append((
+                f"{name}_thumb", f"{name}_thumb{image_format.extension}",
+                image_format.content_type, frame.thumbnail,
+            ))
+        frames_meta.append(entry)
+    
+    boundary = multipart_boundary()
+    return Response(
+        multipart_stream({"frames": frames_meta, "progress": 100}, parts, boundary),
+        mimetype=f"{MULTIPART_MIMETYPE}; boundary={boundary}",
+    )
+
+
+def merge_video(video_path: str, background_paths: List[str], start=None, end=None, roi=None):
+    """
+    Merge video with one or more background images in a single pass
+    With an ROI the person is segmented inside it; everything outside is background
+    """
     cap = cv2.VideoCapture(video_path)
-    bg_image = cv2.imread(background_path)
     
     fps = int(cap.get(cv2.CAP_PROP_FPS)) or 30
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     
-    bg_image = cv2.resize(bg_image, (width, height))
+    # Reject a bad ROI, window or background before any output file exists
+    try:
+        roi = parse_roi(roi, width, height)
+        first, stop = frame_range(cap, start, end)
+        
+        bg_images = []
+        for background_path in background_paths:
+            bg_image = cv2.imread(background_path)
+            if bg_image is None:
+                raise ValueError("Could not load background image")
+            bg_images.append(cv2.resize(bg_image, (width, height)))
+    except ValueError:
+        cap.release()
+        raise
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as output_file:
-        output_path = output_file.name
+    output_paths = []
+    for _ in bg_images:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as output_file:
+            output_paths.append(output_file.name)
     
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-    
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_idx = 0
+    writers = [cv2.VideoWriter(path, fourcc, fps, (width, height)) for path in output_paths]
+    buffers = [np.empty_like(bg) for bg in bg_images]
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = segment.process(rgb_frame)
-        
-        if results.segmentation_mask is not None:
-            mask = results.segmentation_mask > 0.1
-            condition = np.stack((mask,) * 3, axis=-1)
-            output_frame = np.where(condition, frame, bg_image).astype(np.uint8)
-        else:
-            output_frame = frame
-        
-        out.write(output_frame)
-        frame_idx += 1
+    def composite_and_write(i, frame, mask):
+        with metrics.timer("composite", "merge_video"):
+            if mask is not None:
+                np.copyto(buffers[i], bg_images[i])
+                cv2.copyTo(frame, mask, buffers[i])
+                output_frame = buffers[i]
+            else:
+                output_frame = frame
+        with metrics.timer("encode", "merge_video"):
+            writers[i].write(output_frame)
     
-    cap.release()
-    out.release()
+    pool = ThreadPoolExecutor(max_workers=len(writers)) if len(writers) > 1 else None
     
-    # Read and encode output video
-    with open(output_path, "rb") as f:
-        video_data = f.read()
+    masks = mask_source(video_path, width, height, "merge_video", roi, record=first == 0 and end is None)
+    roi_mask = np.zeros((height, width), dtype=np.uint8) if roi else None
     
-    os.unlink(output_path)
+    frame_idx = first
+    complete = False
+    try:
+        while cap.isOpened() and frame_idx < stop:
+            with metrics.timer("decode", "merge_video"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            
+            segmentation_mask = masks.mask(frame_idx, frame)
+            
+            mask = None
+            if segmentation_mask is not None:
+                mask = (segmentation_mask > 0.1).astype(np.uint8)
+                if roi_mask is not None:
+                    x, y, w, h = roi
+                    roi_mask[y:y + h, x:x + w] = mask
+                    mask = roi_mask
+            
+            if pool:
+                list(pool.map(lambda i: composite_and_write(i, frame, mask), range(len(writers))))
+            else:
+                composite_and_write(0, frame, mask)
+            frame_idx += 1
+            metrics.count("frames", action="merge_video")
+        complete = True
+    finally:
+        masks.close(complete)
+        if pool:
+            pool.shutdown()
+        cap.release()
+        for writer in writers:
+            writer.release()
     
-    video_base64 = base64.b64encode(video_data).decode("utf-8")
+    # Read and encode output videos
+    videos_base64 = []
+    for output_path in output_paths:
+        with open(output_path, "rb") as f:
+            video_data = f.read()
+        os.unlink(output_path)
+        
+        with metrics.timer("base64", "merge_video"):
+            videos_base64.append(base64.b64encode(video_data).decode("utf-8"))
     
-    return jsonify({
-        "video_base64": video_base64,
+    response = {
+        "video_base64": videos_base64[0],
         "progress": 100,
-    })
+    }
+    if len(videos_base64) > 1:
+        response["videos_base64"] = videos_base64
+    return jsonify(response)
 
 
 if __name__ == "__main__":
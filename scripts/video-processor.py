@@ -5,39 +5,48 @@ Extracts best frames with selfie detection and sharpness scoring
 Optionally merges video with background image
 """
 
+import argparse
 import cv2
 import mediapipe as mp
 import numpy as np
 import json
 import sys
 import os
-from typing import List, Tuple, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, Sequence, Union
 import tempfile
 
+from frame_encoding import EncodeOptions, encode_frames, encode_options
+from mask_track import SegmentationSource
+from video_metrics import Metrics
+from video_window import Roi, crop, frame_range, parse_roi
+
 mp_selfie = mp.solutions.selfie_segmentation
 mp_drawing = mp.solutions.drawing_utils
 
+# Enabled by --profile; disabled timers are a shared no-op
+metrics = Metrics(enabled=False)
+
 
 def calculate_sharpness(image: np.ndarray) -> float:
     """Calculate image sharpness using Laplacian variance"""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    with metrics.timer("sharpness"):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
     return laplacian_var
 
 
-def has_selfie_segmentation(frame: np.ndarray, segment: mp_selfie.SelfieSegmentation) -> Tuple[bool, float]:
-    """Check if frame has selfie segmentation and return quality score"""
-    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = segment.process(rgb_frame)
-    
-    if results.segmentation_mask is None:
+def score_selfie_mask(segmentation_mask: Optional[np.ndarray]) -> Tuple[bool, float]:
+    """Selfie check on a segmentation mask (at any resolution)"""
+    if segmentation_mask is None:
         return False, 0.0
     
-    mask = results.segmentation_mask > 0.5
-    segmentation_quality = float(np.mean(results.segmentation_mask))
+    mask = segmentation_mask > 0.5
+    segmentation_quality = float(np.mean(segmentation_mask))
     
     # Check if there's a significant selfie area (at least 10% of frame)
-    selfie_area = np.sum(mask) / (frame.shape[0] * frame.shape[1])
+    selfie_area = np.count_nonzero(mask) / mask.size
     has_selfie = selfie_area > 0.1 and segmentation_quality > 0.3
     
     return has_selfie, segmentation_quality
@@ -46,32 +55,106 @@ def has_selfie_segmentation(frame: np.ndarray, segment: mp_selfie.SelfieSegmenta
 def extract_best_frames(
     video_path: str,
     count: int,
-    output_dir: str
+    output_dir: str,
+    mask_track_dir: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    roi: Union[None, str, Sequence[int]] = None,
+    encoding: Optional[EncodeOptions] = None
 ) -> List[dict]:
-    """Extract best frames with selfie segmentation"""
+    """
+    Extract best frames with selfie segmentation
+    Only frames between `start` and `end` seconds are decoded; with an ROI
+    (x,y,w,h) sharpness and segmentation run on that crop only
+    The winners are encoded in parallel as `encoding` (format, quality,
+    optional thumbnail long side) describes; JPEG at quality 95 by default
+    """
+    encoding = encoding or encode_options()
     cap = cv2.VideoCapture(video_path)
     segment = mp_selfie.SelfieSegmentation(model_selection=1)  # 1 for video
     
     fps = cap.get(cv2.CAP_PROP_FPS)
     frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     
-    candidates = []
-    frame_idx = 0
+    roi = parse_roi(roi, width, height)
+    first, stop = frame_range(cap, start, end)
+    
+    # Masks come from a stored track when this video was segmented before
+    masks = SegmentationSource(
+        segment, video_path, width, height, mask_track_dir, metrics.timer,
+        roi=roi, record=first == 0 and end is None,
+    )
+    if masks.from_track:
+        print("Using stored mask track", file=sys.stderr)
+    
+    print(f"Processing {min(stop, frame_count) - first} frames...", file=sys.stderr)
     
-    print(f"Processing {frame_count} frames...", file=sys.stderr)
+    complete = False
+    try:
+        candidates = _score_frames(cap, masks, fps, first, stop, roi)
+        complete = True
+    finally:
+        masks.close(complete)
+        cap.release()
     
-    while cap.isOpened():
-        ret, frame = cap.read()
+    # Sort by score and take top N
+    candidates.sort(key=lambda x: x['score'], reverse=True)
+    best_frames = candidates[:count]
+    
+    # Encode in parallel, then save frames
+    encoded = encode_frames([c['frame'] for c in best_frames], encoding, metrics.timer)
+    extension = encoding.image_format.extension
+    
+    results = []
+    for i, (candidate, frame) in enumerate(zip(best_frames, encoded)):
+        output_path = os.path.join(output_dir, f"frame_{i+1}{extension}")
+        with metrics.timer("write"):
+            frame.image.tofile(output_path)
+        
+        result = {
+            'index': i + 1,
+            'timestamp': candidate['timestamp'],
+            'score': candidate['score'],
+            'path': output_path
+        }
+        if frame.thumbnail is not None:
+            thumbnail_path = os.path.join(output_dir, f"frame_{i+1}_thumb{extension}")
+            with metrics.timer("write"):
+                frame.thumbnail.tofile(thumbnail_path)
+            result['thumbnail_path'] = thumbnail_path
+        results.append(result)
+    
+    return results
+
+
+def _score_frames(
+    cap,
+    masks: SegmentationSource,
+    fps: float,
+    first: int,
+    stop: int,
+    roi: Optional[Roi]
+) -> List[dict]:
+    """Score frames [first, stop) and return the selfie candidates"""
+    candidates = []
+    frame_idx = first
+    total = max(1, stop - first) if stop < sys.maxsize else 0
+    
+    while cap.isOpened() and frame_idx < stop:
+        with metrics.timer("decode"):
+            ret, frame = cap.read()
         if not ret:
             break
         
         timestamp = frame_idx / fps if fps > 0 else frame_idx * 0.033
         
         # Calculate sharpness
-        sharpness = calculate_sharpness(frame)
+        sharpness = calculate_sharpness(crop(frame, roi))
         
         # Check for selfie segmentation
-        has_selfie, seg_quality = has_selfie_segmentation(frame, segment)
+        has_selfie, seg_quality = score_selfie_mask(masks.mask(frame_idx, frame, full_size=False))
         
         if has_selfie:
             # Combined score: sharpness + segmentation quality
@@ -87,32 +170,15 @@ def extract_best_frames(
             })
         
         frame_idx += 1
+        metrics.count("frames")
         
         # Progress update every 10%
-        if frame_idx % (frame_count // 10) == 0:
-            progress = int((frame_idx / frame_count) * 100)
+        done = frame_idx - first
+        if total and done % max(1, total // 10) == 0:
+            progress = int((done / total) * 100)
             print(f"PROGRESS:{progress}", file=sys.stderr)
     
-    cap.release()
-    
-    # Sort by score and take top N
-    candidates.sort(key=lambda x: x['score'], reverse=True)
-    best_frames = candidates[:count]
-    
-    # Save frames
-    results = []
-    for i, candidate in enumerate(best_frames):
-        output_path = os.path.join(output_dir, f"frame_{i+1}.jpg")
-        cv2.imwrite(output_path, candidate['frame'])
-        
-        results.append({
-            'index': i + 1,
-            'timestamp': candidate['timestamp'],
-            'score': candidate['score'],
-            'path': output_path
-        })
-    
-    return results
+    return candidates
 
 
 def merge_video_with_background(
@@ -121,98 +187,227 @@ def merge_video_with_background(
     output_path: str
 ) -> str:
     """Merge video with background image using selfie segmentation"""
+    return merge_video_with_backgrounds(video_path, [background_path], [output_path])[0]
+
+
+def merge_video_with_backgrounds(
+    video_path: str,
+    background_paths: List[str],
+    output_paths: List[str],
+    mask_track_dir: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    roi: Union[None, str, Sequence[int]] = None
+) -> List[str]:
+    """
+    Merge video with several background images in one pass
+    Each frame is decoded and segmented once; the composites for all
+    backgrounds are written in parallel
+    Only frames between `start` and `end` seconds are merged; with an ROI
+    the person is segmented inside it and everything outside is background
+    """
+    if len(background_paths) != len(output_paths):
+        raise ValueError("Need one output path per background")
+    
     cap = cv2.VideoCapture(video_path)
     segment = mp_selfie.SelfieSegmentation(model_selection=1)
     
-    # Load background image
-    bg_image = cv2.imread(background_path)
-    if bg_image is None:
-        raise ValueError("Could not load background image")
-    
     # Get video properties
     fps = int(cap.get(cv2.CAP_PROP_FPS)) or 30
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     
-    # Resize background to match video dimensions
-    bg_image = cv2.resize(bg_image, (width, height))
+    # Validate everything before the writers create (empty) output files
+    try:
+        roi = parse_roi(roi, width, height)
+        first, stop = frame_range(cap, start, end)
+        
+        # Load backgrounds, resized to match video dimensions
+        bg_images = []
+        for background_path in background_paths:
+            bg_image = cv2.imread(background_path)
+            if bg_image is None:
+                raise ValueError(f"Could not load background image: {background_path}")
+            bg_images.append(cv2.resize(bg_image, (width, height)))
+    except ValueError:
+        cap.release()
+        raise
     
-    # Setup video writer
+    # Setup one video writer (and one reusable output buffer) per background
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    writers = [cv2.VideoWriter(path, fourcc, fps, (width, height)) for path in output_paths]
+    buffers = [np.empty_like(bg) for bg in bg_images]
+    
+    def composite_and_write(i: int, frame: np.ndarray, mask: Optional[np.ndarray]):
+        with metrics.timer("composite"):
+            if mask is not None:
+                # Foreground where mask is set, background elsewhere
+                np.copyto(buffers[i], bg_images[i])
+                cv2.copyTo(frame, mask, buffers[i])
+                output_frame = buffers[i]
+            else:
+                # No segmentation, use original frame
+                output_frame = frame
+        with metrics.timer("encode"):
+            writers[i].write(output_frame)
+    
+    # cv2 releases the GIL while compositing and encoding
+    pool = ThreadPoolExecutor(max_workers=len(writers)) if len(writers) > 1 else None
+    
+    masks = SegmentationSource(
+        segment, video_path, width, height, mask_track_dir, metrics.timer,
+        roi=roi, record=first == 0 and end is None,
+    )
+    if masks.from_track:
+        print("Using stored mask track", file=sys.stderr)
+    
+    # ROI masks are pasted into a full-frame mask that is zero (background) elsewhere
+    roi_mask = np.zeros((height, width), dtype=np.uint8) if roi else None
     
     frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_idx = 0
+    total = min(stop, frame_count) - first
+    frame_idx = first
     
-    print(f"Merging {frame_count} frames...", file=sys.stderr)
+    print(f"Merging {total} frames onto {len(bg_images)} background(s)...", file=sys.stderr)
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Get segmentation mask
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = segment.process(rgb_frame)
-        
-        if results.segmentation_mask is not None:
-            mask = results.segmentation_mask > 0.1
+    complete = False
+    try:
+        while cap.isOpened() and frame_idx < stop:
+            with metrics.timer("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
             
-            # Create 3-channel mask
-            condition = np.stack((mask,) * 3, axis=-1)
+            # Get segmentation mask
+            segmentation_mask = masks.mask(frame_idx, frame)
             
-            # Merge: foreground where mask is True, background elsewhere
-            output_frame = np.where(condition, frame, bg_image).astype(np.uint8)
-        else:
-            # No segmentation, use original frame
-            output_frame = frame
-        
-        out.write(output_frame)
-        frame_idx += 1
-        
-        # Progress update
-        if frame_idx % (frame_count // 10) == 0:
-            progress = int((frame_idx / frame_count) * 100)
-            print(f"PROGRESS:{progress}", file=sys.stderr)
-    
-    cap.release()
-    out.release()
+            mask = None
+            if segmentation_mask is not None:
+                mask = (segmentation_mask > 0.1).astype(np.uint8)
+                if roi_mask is not None:
+                    x, y, w, h = roi
+                    roi_mask[y:y + h, x:x + w] = mask
+                    mask = roi_mask
+            
+            if pool:
+                list(pool.map(lambda i: composite_and_write(i, frame, mask), range(len(writers))))
+            else:
+                composite_and_write(0, frame, mask)
+            
+            frame_idx += 1
+            metrics.count("frames")
+            
+            # Progress update
+            done = frame_idx - first
+            if total > 0 and done % max(1, total // 10) == 0:
+                progress = int((done / total) * 100)
+                print(f"PROGRESS:{progress}", file=sys.stderr)
+        complete = True
+    finally:
+        masks.close(complete)
+        if pool:
+            pool.shutdown()
+        cap.release()
+        for writer in writers:
+            writer.release()
     
-    return output_path
+    return output_paths
+
+
+def output_paths_for(output_path: str, count: int) -> List[str]:
+    """out.mp4 -> [out.mp4] for one background, [out_1.mp4, out_2.mp4, ...] for several"""
+    if count == 1:
+        return [output_path]
+    stem, ext = os.path.splitext(output_path)
+    return [f"{stem}_{i + 1}{ext or '.mp4'}" for i in range(count)]
 
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: video-processor.py <command> <args...>", file=sys.stderr)
-        sys.exit(1)
-    
-    command = sys.argv[1]
-    
-    if command == "extract":
-        # Extract best frames
-        # Args: video_path, count, output_dir
-        video_path = sys.argv[2]
-        count = int(sys.argv[3])
-        output_dir = sys.argv[4]
-        
-        os.makedirs(output_dir, exist_ok=True)
-        results = extract_best_frames(video_path, count, output_dir)
+    parser = argparse.ArgumentParser(
+        prog="video-processor.py",
+        description="Extract best frames or merge a video with a background",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="Write per-stage timings as JSON to PATH ('-' for stderr)",
+    )
+    parser.add_argument(
+        "--mask-cache",
+        metavar="DIR",
+        default=os.environ.get("MASK_TRACK_DIR"),
+        help="Store/reuse per-video segmentation mask tracks in DIR (default: $MASK_TRACK_DIR)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract = commands.add_parser("extract", help="Extract best frames")
+    extract.add_argument("video_path")
+    extract.add_argument("count", type=int)
+    extract.add_argument("output_dir")
+    extract.add_argument("--format", choices=["jpeg", "jpg", "webp"], default="jpeg", help="Image format (default: jpeg)")
+    extract.add_argument("--quality", type=int, help="Encoder quality 1-100 (default: 95)")
+    extract.add_argument("--thumbnail", type=int, metavar="PX", help="Also write thumbnails with this long side")
+
+    merge = commands.add_parser(
+        "merge",
+        help="Merge video with one or more backgrounds",
+        description="With several backgrounds, outputs are named <output>_1.mp4, <output>_2.mp4, ...",
+    )
+    merge.add_argument("video_path")
+    merge.add_argument("background_paths", nargs="+", metavar="background_path")
+    merge.add_argument("output_path")
+
+    for sub in (extract, merge):
+        sub.add_argument("--start", type=float, help="Window start in seconds")
+        sub.add_argument("--end", type=float, help="Window end in seconds")
+        sub.add_argument("--roi", metavar="X,Y,W,H", help="Region of interest in pixels")
+    
+    # Options are accepted before or after the command
+    for sub in (extract, merge):
+        sub.add_argument("--profile", metavar="PATH", default=argparse.SUPPRESS)
+        sub.add_argument("--mask-cache", metavar="DIR", default=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    metrics.enabled = bool(args.profile)
+    started = time.perf_counter()
+    
+    if args.command == "extract":
+        try:
+            encoding = encode_options(args.format, args.quality, args.thumbnail)
+        except ValueError as e:
+            parser.error(str(e))
+        os.makedirs(args.output_dir, exist_ok=True)
+        try:
+            results = extract_best_frames(
+                args.video_path, args.count, args.output_dir, args.mask_cache,
+                start=args.start, end=args.end, roi=args.roi, encoding=encoding,
+            )
+        except ValueError as e:
+            parser.error(str(e))
         
         print(json.dumps(results))
         
-    elif command == "merge":
-        # Merge video with background
-        # Args: video_path, background_path, output_path
-        video_path = sys.argv[2]
-        background_path = sys.argv[3]
-        output_path = sys.argv[4]
-        
-        merge_video_with_background(video_path, background_path, output_path)
-        print(json.dumps({"output_path": output_path}))
+    elif args.command == "merge":
+        output_paths = output_paths_for(args.output_path, len(args.background_paths))
+        try:
+            merge_video_with_backgrounds(
+                args.video_path, args.background_paths, output_paths, args.mask_cache,
+                start=args.start, end=args.end, roi=args.roi,
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        print(json.dumps({"output_path": output_paths[0], "output_paths": output_paths}))
+    
+    if args.profile:
+        report = metrics.report()
+        report["command"] = args.command
+        report["wall_seconds"] = round(time.perf_counter() - started, 4)
         
-    else:
-        print(f"Unknown command: {command}", file=sys.stderr)
-        sys.exit(1)
+        if args.profile == "-":
+            print(json.dumps(report), file=sys.stderr)
+        else:
+            with open(args.profile, "w") as f:
+                json.dump(report, f, indent=2)
 
 
 if __name__ == "__main__":
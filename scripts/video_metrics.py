@@ -0,0 +1,173 @@
+"""
+Lightweight per-stage timing shared by video-processor.py and
+video-processor-service.py
+Timers aggregate into histograms that can be dumped as a JSON profile (CLI)
+or exposed in Prometheus text format (service /metrics).
+When disabled, timer() hands back one shared no-op object.
+"""
+
+import bisect
+import functools
+import threading
+import time
+from typing import Dict, Tuple
+
+# Seconds; per-frame stages sit in the low buckets, whole requests in the high ones
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "total", "max")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bucket bound containing the q-th observation"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.max
+
+
+class _Timer:
+    __slots__ = ("metrics", "key", "started")
+
+    def __init__(self, metrics: "Metrics", key: Tuple[str, str]):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.key, time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    def __init__(self, enabled: bool = True, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.counters: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def timer(self, stage: str, action: str = ""):
+        """`with metrics.timer("decode"): ...`"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, (action, stage))
+
+    def timed(self, stage: str, action: str = ""):
+        """Decorator form of timer()"""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage, action):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def observe(self, key: Tuple[str, str], seconds: float) -> None:
+        """Record one duration for (action, stage)"""
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    def count(self, name: str, value: float = 1, action: str = "") -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[(action, name)] = self.counters.get((action, name), 0) + value
+
+    def report(self) -> dict:
+        """JSON-friendly summary: per stage count/total/mean/p50/p95/max seconds"""
+        with self._lock:
+            stages = {}
+            for (action, name), h in sorted(self.histograms.items()):
+                stages[f"{action}:{name}" if action else name] = {
+                    "count": h.count,
+                    "total": round(h.total, 6),
+                    "mean": round(h.total / h.count, 6) if h.count else 0.0,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "max": round(h.max, 6),
+                }
+            counters = {
+                (f"{action}:{name}" if action else name): value
+                for (action, name), value in sorted(self.counters.items())
+            }
+        return {"stages": stages, "counters": counters}
+
+    def prometheus(self, prefix: str = "video_processor") -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        def escape(value: str) -> str:
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def labels(*pairs: Tuple[str, str]) -> str:
+            parts = [f'{k}="{escape(str(v))}"' for k, v in pairs if v != ""]
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        name = f"{prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Time spent per processing stage",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for (action, stage), h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    le = labels(("action", action), ("stage", stage), ("le", str(bound)))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                le = labels(("action", action), ("stage", stage), ("le", "+Inf"))
+                lines.append(f"{name}_bucket{le} {h.count}")
+                lines.append(f"{name}_sum{labels(('action', action), ('stage', stage))} {h.total}")
+                lines.append(f"{name}_count{labels(('action', action), ('stage', stage))} {h.count}")
+
+            counter_names = sorted({counter for _, counter in self.counters})
+            for counter in counter_names:
+                lines.append(f"# TYPE {prefix}_{counter}_total counter")
+                for (action, other), value in sorted(self.counters.items()):
+                    if other == counter:
+                        lines.append(f"{prefix}_{counter}_total{labels(('action', action))} {value}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,92 @@
+"""
+Time window and region of interest for extract / merge
+The decoder seeks straight to the window start and stops at its end;
+segmentation and sharpness only look at the ROI crop.
+"""
+
+import sys
+from typing import Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+
+Roi = Tuple[int, int, int, int]
+
+
+def parse_seconds(value, name: str) -> Optional[float]:
+    """Window bound from a request: None, or a finite number of seconds (strings allowed)"""
+    if value is None or value == "":
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number of seconds") from None
+    if not np.isfinite(seconds):
+        raise ValueError(f"{name} must be a number of seconds")
+    return seconds
+
+
+def parse_roi(value: Union[None, str, Sequence], width: int, height: int) -> Optional[Roi]:
+    """
+    "x,y,w,h" or [x, y, w, h] in pixels, clamped to the frame
+    Returns None for no ROI or one that covers the whole frame
+    """
+    if value is None or value == "":
+        return None
+    try:
+        parts = value.split(",") if isinstance(value, str) else list(value)
+        if len(parts) != 4:
+            raise ValueError
+        x, y, w, h = (int(round(float(p))) for p in parts)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("ROI must be x,y,w,h") from None
+    x, y = max(0, x), max(0, y)
+    w, h = min(w, width - x), min(h, height - y)
+    if w <= 0 or h <= 0:
+        raise ValueError("ROI is outside the frame")
+    if (x, y, w, h) == (0, 0, width, height):
+        return None
+    return x, y, w, h
+
+
+def frame_range(
+    cap: cv2.VideoCapture,
+    start: Optional[float],
+    end: Optional[float],
+) -> Tuple[int, int]:
+    """
+    Seek `cap` to `start` seconds; return (first frame index, end frame
+    index exclusive), clamped to the clip's frame count when it is known
+    """
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    first = max(0, int(round((start or 0) * fps)))
+    stop = int(round(end * fps)) if end is not None else sys.maxsize
+    if frame_count > 0:
+        stop = min(stop, frame_count)
+
+    if stop <= first:
+        raise ValueError("Empty time window: end must be after start and within the clip")
+
+    if first:
+        # Seeks to the nearest keyframe and decodes forward from there
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+        first = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+
+    return first, stop
+
+
+def crop(image: np.ndarray, roi: Optional[Roi], frame_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    View of the ROI in `image`; when `image` is smaller than the frame
+    (`frame_size` = (w, h), e.g. a stored mask) the ROI is scaled to it
+    """
+    if roi is None:
+        return image
+    x, y, w, h = roi
+    if frame_size and (image.shape[1], image.shape[0]) != frame_size:
+        sx = image.shape[1] / frame_size[0]
+        sy = image.shape[0] / frame_size[1]
+        x, y = int(x * sx), int(y * sy)
+        w, h = max(1, int(round(w * sx))), max(1, int(round(h * sy)))
+    return image[y:y + h, x:x + w]